@@ -76,6 +76,45 @@ def cli():
     default=False,
     help="Skip creating symlinks",
 )
+@click.option(
+    "--segments",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of concurrent byte-range connections used to download a release",
+)
+@click.option(
+    "--resume/--no-resume",
+    default=False,
+    help="Keep interrupted downloads as *.part files and continue them in the next run",
+)
+@click.option(
+    "--stripe/--no-stripe",
+    default=False,
+    help="Download different parts of the release from several mirrors at once",
+)
+@click.option(
+    "--race",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Start downloading from this many mirrors and keep the fastest one",
+)
+@click.option(
+    "--stream-verify/--no-stream-verify",
+    "--stream_verify/--no_stream_verify",
+    default=False,
+    help="Fetch the GPG signature first and verify the release while downloading",
+)
+@click.option(
+    "--refresh-mirrors/--no-refresh-mirrors",
+    "--refresh_mirrors/--no_refresh_mirrors",
+    default=False,
+    help="Measure all mirrors again instead of using the cached results",
+)
+@click.option(
+    "--offline/--no-offline",
+    default=False,
+    help="Use the cached release information without checking for updates",
+)
 def install(**kwargs):
     """Install Julia programming language.
 
@@ -146,6 +185,45 @@ def list(**kwargs):
     default=False,
     help="Skip SSL certificate validation",
 )
+@click.option(
+    "--segments",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of concurrent byte-range connections used to download a release",
+)
+@click.option(
+    "--resume/--no-resume",
+    default=False,
+    help="Keep interrupted downloads as *.part files and continue them in the next run",
+)
+@click.option(
+    "--stripe/--no-stripe",
+    default=False,
+    help="Download different parts of the release from several mirrors at once",
+)
+@click.option(
+    "--race",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Start downloading from this many mirrors and keep the fastest one",
+)
+@click.option(
+    "--stream-verify/--no-stream-verify",
+    "--stream_verify/--no_stream_verify",
+    default=False,
+    help="Fetch the GPG signature first and verify the release while downloading",
+)
+@click.option(
+    "--refresh-mirrors/--no-refresh-mirrors",
+    "--refresh_mirrors/--no_refresh_mirrors",
+    default=False,
+    help="Measure all mirrors again instead of using the cached results",
+)
+@click.option(
+    "--offline/--no-offline",
+    default=False,
+    help="Use the cached release information without checking for updates",
+)
 def download(**kwargs):
     """Download Julia release from nearest servers.
 
@@ -192,13 +270,29 @@ def switch(**kwargs):
 
 
 @cli.command()
-def upstream():
+@click.option(
+    "--refresh-mirrors/--no-refresh-mirrors",
+    "--refresh_mirrors/--no_refresh_mirrors",
+    default=False,
+    help="Measure all mirrors again instead of using the cached results",
+)
+@click.option(
+    "--bench/--no-bench",
+    default=False,
+    help="Download the first few MB of a release from every host to measure the throughput",
+)
+@click.option(
+    "--save/--no-save",
+    default=False,
+    help="Use the benchmark results to order mirrors in later downloads",
+)
+def upstream(**kwargs):
     """Show upstream information and available mirrors.
 
     This command displays information about available upstream servers
     and mirrors that can be used for downloading Julia releases.
     """
-    show_upstream()
+    show_upstream(**kwargs)
 
 
 def main():
@@ -2,18 +2,23 @@ from .utils import SourceRegistry, verify_upstream
 from .utils import latest_version
 from .utils import is_version_released
 from .utils import is_full_version
+from .utils import query_release_file
 from .utils import current_system, current_architecture, current_libc
-from .utils import verify_gpg
+from .utils import verify_gpg, GPGStreamVerifier
+from .utils import refresh_mirrors as _refresh_mirrors
+from .utils import use_offline_catalog, CatalogUnavailable
 from .utils import color
 from .utils.filters import canonicalize_sys, canonicalize_arch
-from .utils.net_utils import download
+from .utils.net_utils import download, is_modified, DownloadCancelled
+from .utils.mirror_utils import NIGHTLY_READ_TIMEOUT
 
 import re
 import os
-import shutil
 import ssl
-import tempfile
+import threading
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 from urllib.parse import urlparse
 
 from urllib.error import URLError
@@ -37,34 +42,125 @@ class SSLContext:
             ssl._create_default_https_context = self.prev_create_context
 
 
-def _download(url: str, out: str, *, bypass_ssl: bool = False):
+def _try_download(url: str, outpath: str, **kwargs):
+    outname = os.path.basename(outpath)
+    try:
+        msg = f"downloading from {url}"
+        logging.info(msg)
+        print(msg)
+        if kwargs.get("bypass_ssl", False):
+            print(f"{color.YELLOW}skip SSL certificate validation{color.END}")
+        download(url, outpath, **kwargs)
+        print()  # for format usage
+        msg = f"finished downloading {outname}"
+        print(f"{color.GREEN}{msg}{color.END}")
+    except DownloadCancelled:
+        # another download that this one depends on has failed
+        msg = f"cancel downloading {outname}"
+        logging.info(msg)
+        print(f"{color.YELLOW}{msg}{color.END}")
+        return False
+    except (URLError, ConnectionError, Exception) as e:
+        msg = f"failed to download {outname}: {str(e)}"
+        logging.info(msg)
+        print(f"{color.RED}{msg}{color.END}")
+        return False
+    return True
+
+
+def _download(
+    url: str,
+    out: str,
+    *,
+    bypass_ssl: bool = False,
+    segments: int = 1,
+    resume: bool = False,
+    mirrors=(),
+    racers=(),
+    fallbacks=(),
+    cancel=None,
+    size=None,
+    sha256=None,
+    sinks=(),
+    validators=None,
+):
     # always do overwrite
     outpath = os.path.abspath(out)
-    outdir, outname = os.path.split(outpath)
+    outdir = os.path.dirname(outpath)
+    kwargs = dict(
+        bypass_ssl=bypass_ssl,
+        segments=segments,
+        resume=resume,
+        mirrors=mirrors,
+        racers=racers,
+        fallbacks=fallbacks,
+        cancel=cancel,
+        size=size,
+        sha256=sha256,
+        sinks=sinks,
+        validators=validators,
+    )
 
-    with tempfile.TemporaryDirectory() as temp_outdir:
-        temp_outpath = os.path.join(temp_outdir, outname)
-        try:
-            msg = f"downloading from {url}"
-            logging.info(msg)
-            print(msg)
-            if bypass_ssl:
-                print(f"{color.YELLOW}skip SSL certificate validation{color.END}")
-            download(url, temp_outpath, bypass_ssl=bypass_ssl)
-            print()  # for format usage
-            msg = f"finished downloading {outname}"
-            print(f"{color.GREEN}{msg}{color.END}")
-        except (URLError, ConnectionError, Exception) as e:
-            msg = f"failed to download {outname}: {str(e)}"
-            logging.info(msg)
-            print(f"{color.RED}{msg}{color.END}")
-            return False
+    # download in place, `download` writes to a `.part` file in outdir and renames it
+    # to outpath once it's finished
+    os.makedirs(outdir, exist_ok=True)
+    return outpath if _try_download(url, outpath, **kwargs) else False
+
+
+def _download_concurrently(*jobs, **kwargs):
+    """
+    Run `_download(url, out, **job_kwargs, **kwargs)` for all `(url, out, job_kwargs)`
+    in `jobs` at the same time and return their results together with the index of
+    the job that failed first (`None` if all jobs succeed). Once a job fails, all
+    other jobs are cancelled.
+    """
+    cancel = threading.Event()
+    failed = []
 
-        if not os.path.isdir(outdir):
-            os.makedirs(outdir, exist_ok=True)
-        shutil.move(temp_outpath, outpath)
+    def _run(index, url, out, job_kwargs):
+        rst = _download(url, out, cancel=cancel, **job_kwargs, **kwargs)
+        if not rst:
+            # cancelled jobs fail after the job that cancels them
+            failed.append(index)
+            cancel.set()
+        return rst
 
-    return outpath
+    try:
+        with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+            futures = [executor.submit(_run, i, *job) for i, job in enumerate(jobs)]
+            results = [future.result() for future in futures]
+        return results, (failed[0] if failed else None)
+    except BaseException:
+        # e.g., KeyboardInterrupt
+        cancel.set()
+        raise
+
+
+def _download_and_verify(url: str, out: str, package_kwargs, **kwargs):
+    """
+    Download the GPG signature first, and then verify the package while it is being
+    downloaded. Return `(package_path, gpg_signature_path, is_verified)`, where
+    `is_verified` is `None` if gpg can't be started and the package needs to be
+    verified after it's downloaded.
+    """
+    gpg_signature_path = _download(url + ".asc", out + ".asc", **kwargs)
+    if not gpg_signature_path:
+        return False, False, False
+    with ExitStack() as stack:
+        try:
+            verifier = stack.enter_context(GPGStreamVerifier(gpg_signature_path))
+        except OSError as e:
+            # e.g., gpg isn't installed
+            msg = f"failed to verify the download on the fly: {str(e)}"
+            logging.info(msg)
+            print(f"{color.YELLOW}{msg}{color.END}")
+            package_path = _download(url, out, **package_kwargs, **kwargs)
+            return package_path, gpg_signature_path, None
+        package_path = _download(
+            url, out, sinks=[verifier], **package_kwargs, **kwargs
+        )
+        is_verified = bool(package_path) and verifier.result()
+    return package_path, gpg_signature_path, is_verified
 
 
 def download_package(
@@ -76,6 +172,14 @@ def download_package(
     outdir=None,
     overwrite=False,
     bypass_ssl=False,
+    segments=1,
+    resume=False,
+    stripe=False,
+    race=1,
+    stream_verify=False,
+    validators=None,
+    refresh_mirrors=False,
+    offline=False,
 ):
     """Download Julia release from nearest servers.
 
@@ -88,11 +192,31 @@ def download_package(
         outdir: Output directory
         overwrite: Overwrite existing files
         bypass_ssl: Skip SSL verification
+        segments: Number of concurrent byte-range connections for the download
+        resume: Keep partial downloads and continue them in the next run
+        stripe: Fetch different parts of the release from several mirrors at once
+        race: Number of candidate mirrors to race against each other
+        stream_verify: Verify the GPG signature while downloading
+        validators: A dict with the validators of the previously installed nightly build.
+            `True` is returned without downloading if the nightly build isn't modified
+            since then; otherwise it's updated with the validators of the new download
+        refresh_mirrors: Measure all mirrors again instead of using the cached results
+        offline: Use the cached release information without checking for updates
+
+    Returns:
+        The path to the downloaded file, or `False`/`None` if it fails to download.
+        `True` is only returned if `validators` is given and the nightly build isn't
+        modified; there's no file to return in that case, so callers that pass
+        `validators` have to check for it before using the result as a path.
     """
     version = str(version) if (version or str(version) == "0") else ""
     version = "latest" if version == "nightly" else version
     version = "" if version == "stable" else version
     upstream = upstream if upstream else os.environ.get("JILL_UPSTREAM", None)
+    if refresh_mirrors:
+        _refresh_mirrors()
+    if offline:
+        use_offline_catalog()
 
     system = sys if canonicalize_sys(sys) else current_system()
     if system == "linux" and current_system() == "linux" and current_libc() == "musl":
@@ -121,6 +245,10 @@ def download_package(
         version = latest_version(
             version, system, architecture, upstream=upstream, stable_only=not unstable
         )
+    except CatalogUnavailable as e:
+        logging.error(str(e))
+        print(f"{color.RED}{str(e)}{color.END}")
+        return None
     except ValueError:
         # hide the nested error stack :P
         wrong_args = True
@@ -145,31 +273,36 @@ def download_package(
     logging.info(msg)
     print(msg)
 
-    if version in ["latest", "nightly"] or match_build:
+    if version == "latest" or match_build:
         # It usually takes longer to query from nightlies bucket so please be patient
-        timeout = 30
-        print(f"Set timeout {timeout} seconds")
+        min_read_timeout = NIGHTLY_READ_TIMEOUT
     else:
-        timeout = 5
+        min_read_timeout = 0
 
-    def query_url(upstream, timeout=timeout):
+    def query_url(upstream):
+        """return the download url and the upstream that serves it"""
+        # timeouts of each host are derived from its RTT history, see `timeout_policy`
         registry = SourceRegistry(upstream=upstream)
         url = registry.query_download_url(
-            version, system, architecture, timeout=timeout
+            version,
+            system,
+            architecture,
+            min_read_timeout=min_read_timeout,
+            bypass_ssl=bypass_ssl,
         )
         if url:
-            return url
+            return url, upstream
         # if fails to find an valid url in given upstream, falls back to "Official"
         if upstream in ["Official", "OfficialNightlies"] or upstream is None:
             # if "Official" is already tried, then there's no need to retry
-            return None
+            return None, upstream
         else:
             msg = f"failed to find {release_str} in upstream {upstream}. Fallback to upstream Official."
             logging.warning(msg)
             print(f"{color.RED}{msg}{color.END}")
             return query_url("Official")  # fallback to Official
 
-    url = query_url(upstream)
+    url, source_upstream = query_url(upstream)
     if not url:
         msg = (
             f"failed to find {release_str} in available upstreams. Please try it later."
@@ -188,47 +321,98 @@ def download_package(
     outname = os.path.basename(urlparse(url_str).path)
     outpath = os.path.join(outdir, outname)
 
-    skip_download = False
     if system in ["linux", "freebsd"]:
-        if (
-            os.path.isfile(outpath)
-            and os.path.isfile(outpath + ".asc")
-            and not overwrite
-        ):
-            skip_download = True
+        has_downloads = os.path.isfile(outpath) and os.path.isfile(outpath + ".asc")
     else:
-        if os.path.isfile(outpath) and not overwrite:
-            skip_download = True
-    if skip_download:
+        has_downloads = os.path.isfile(outpath)
+    if has_downloads and not overwrite:
         msg = f"{outname} already exists, skip downloading"
         logging.info(msg)
         print(f"{color.GREEN}{msg}{color.END}")
         return outpath
 
-    package_path = _download(url, outpath, bypass_ssl=bypass_ssl)
+    # nightly builds are overwritten in place, ask the server if it has changed since
+    # the last installation before pulling the whole file again
+    is_nightly = version == "latest"
+    if is_nightly and validators:
+        if not is_modified(url_str, validators, bypass_ssl=bypass_ssl):
+            msg = f"{outname} is not modified since the last installation, skip downloading"
+            logging.info(msg)
+            print(f"{color.GREEN}{msg}{color.END}")
+            return True
+
+    # other candidates come from the upstream that serves `url`, the requested one
+    # might not have this release at all
+    registry = SourceRegistry(upstream=source_upstream)
+    mirrors, racers, fallbacks = [], [], []
+    if stripe:
+        mirrors = registry.query_mirror_urls(version, system, architecture)
+    elif race > 1:
+        # keep the fastest stream of the top candidates
+        racers = registry.query_mirror_urls(version, system, architecture, limit=race)
+    else:
+        # switch to other mirrors if the download stalls
+        fallbacks = registry.query_mirror_urls(version, system, architecture)
 
+    # versions.json records the size and sha256 checksum of every release file, they
+    # are checked while downloading
+    package_kwargs = dict(
+        segments=segments, mirrors=mirrors, racers=racers, fallbacks=fallbacks
+    )
+    if is_nightly and validators is not None:
+        package_kwargs.update(validators=validators)
+    try:
+        release_file = query_release_file(version, outname, upstream=upstream)
+    except Exception as e:
+        release_file = None
+        msg = f"failed to query the checksum of {outname}: {str(e)}"
+        logging.info(msg)
+        print(f"{color.YELLOW}{msg}{color.END}")
+    if release_file:
+        package_kwargs.update(size=release_file["size"], sha256=release_file["sha256"])
+
+    kwargs = dict(bypass_ssl=bypass_ssl, resume=resume)
     if system in ["winnt", "mac"]:
         # macOS and Windows releases are codesigned with certificates
         # that are verified by the operating system during installation
-        return package_path
+        return _download(url, outpath, **package_kwargs, **kwargs)
     elif system in ["linux", "freebsd", "musl"]:
         # need additional verification using GPG
-        if not package_path:
-            return package_path
-
         # a mirror should provides both *.tar.gz and *.tar.gz.asc
-        gpg_signature_path = _download(
-            url + ".asc", outpath + ".asc", bypass_ssl=bypass_ssl
-        )
-        if not gpg_signature_path:
+        if stream_verify:
+            package_path, gpg_signature_path, is_verified = _download_and_verify(
+                url, outpath, package_kwargs, **kwargs
+            )
+            signature_failed = not gpg_signature_path
+        else:
+            # download them at the same time so that a missing signature stops the
+            # tarball download early
+            (package_path, gpg_signature_path), failed = _download_concurrently(
+                (url, outpath, package_kwargs),
+                (url + ".asc", outpath + ".asc", dict()),
+                **kwargs,
+            )
+            signature_failed = failed == 1
+            is_verified = None
+
+        if signature_failed:
             msg = f"failed to download GPG signature for {release_str}\n"
             msg += "remove untrusted/broken file"
             logging.info(msg)
             print(f"{color.RED}{msg}{color.END}")
-            os.remove(package_path)
+            if package_path:
+                os.remove(package_path)
+            return False
+
+        if not package_path:
+            # the signature download might be cancelled when the tarball fails
+            if gpg_signature_path:
+                os.remove(gpg_signature_path)
             return False
 
-        if not verify_gpg(package_path, gpg_signature_path):
+        if is_verified is None:
+            is_verified = verify_gpg(package_path, gpg_signature_path)
+        if not is_verified:
             msg = f"failed to verify {release_str} downloads\n"
             msg += "remove untrusted/broken files"
             logging.info(msg)
@@ -243,5 +427,4 @@ def download_package(
         print(f"{color.GREEN}{msg}{color.END}")
         return package_path
     else:
-        os.remove(package_path)
         raise ValueError(f"unsupported system {sys}")
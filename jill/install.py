@@ -6,9 +6,11 @@ from .utils import latest_version
 from .utils import DmgMounter, TarMounter
 from .utils import Version
 from .utils import verify_upstream
+from .utils import use_offline_catalog, CatalogUnavailable
 from .utils import color, show_verbose
 from .download import download_package
 
+import json
 import os
 import re
 import shutil
@@ -33,6 +35,33 @@ def is_installed(version, check_symlinks=True):
     return True
 
 
+def nightly_validators_path(install_dir):
+    """the validators of the installed nightly build are kept next to it"""
+    return os.path.join(install_dir, ".julia-latest.json")
+
+
+def read_nightly_validators(install_dir):
+    try:
+        with open(nightly_validators_path(install_dir), "r") as f:
+            validators = json.load(f)
+    except (OSError, ValueError):
+        return dict()
+    return validators if isinstance(validators, dict) else dict()
+
+
+def write_nightly_validators(install_dir, validators):
+    path = nightly_validators_path(install_dir)
+    try:
+        if validators:
+            with open(path, "w") as f:
+                json.dump(validators, f)
+        elif os.path.exists(path):
+            os.remove(path)
+    except OSError as e:
+        # the next run downloads the nightly build again
+        print(f"{color.YELLOW}failed to write {path}: {e}{color.END}")
+
+
 def get_exec_version(path):
     ver_cmd = [path, "--version"]
     try:
@@ -284,6 +313,13 @@ def install_julia(
     reinstall=False,
     bypass_ssl=False,
     skip_symlinks=False,
+    segments=1,
+    resume=False,
+    stripe=False,
+    race=1,
+    stream_verify=False,
+    refresh_mirrors=False,
+    offline=False,
 ):
     """Install Julia.
 
@@ -300,6 +336,13 @@ def install_julia(
         reinstall: Force reinstall
         bypass_ssl: Bypass SSL verification
         skip_symlinks: Skip creating symlinks
+        segments: Number of concurrent byte-range connections for the download
+        resume: Keep partial downloads and continue them in the next run
+        stripe: Fetch different parts of the release from several mirrors at once
+        race: Number of candidate mirrors to race against each other
+        stream_verify: Verify the GPG signature while downloading
+        refresh_mirrors: Measure all mirrors again instead of using the cached results
+        offline: Use the cached release information without checking for updates
     """
     install_dir = install_dir if install_dir else default_install_dir()
     install_dir = os.path.abspath(install_dir)
@@ -310,6 +353,8 @@ def install_julia(
     version = "latest" if version == "nightly" else version
     version = "" if version == "stable" else version
     upstream = upstream if upstream else os.environ.get("JILL_UPSTREAM", None)
+    if offline:
+        use_offline_catalog()
 
     if system == "linux" and current_libc() == "musl":
         # currently Julia tags musl as a system, e.g.,
@@ -376,6 +421,9 @@ def install_julia(
         version = latest_version(
             version, system, arch, upstream=upstream, stable_only=not unstable
         )
+    except CatalogUnavailable as e:
+        print(f"{color.RED}{str(e)}{color.END}")
+        return False
     except ValueError:
         # hide the nested error stack :P
         wrong_args = True
@@ -389,6 +437,15 @@ def install_julia(
         return True
 
     overwrite = True if version == "latest" else False
+    # nightly builds are only downloaded and installed again if they've changed since
+    # the last installation
+    validators = None
+    if version == "latest":
+        installed = not reinstall and any(
+            os.path.exists(os.path.join(x, "julia-latest"))
+            for x in (install_dir, symlink_dir)
+        )
+        validators = read_nightly_validators(install_dir) if installed else dict()
     print(f"{color.BOLD}----- Download Julia -----{color.END}")
     package_path = download_package(
         version,
@@ -397,9 +454,20 @@ def install_julia(
         upstream=upstream,
         overwrite=overwrite,
         bypass_ssl=bypass_ssl,
+        segments=segments,
+        resume=resume,
+        stripe=stripe,
+        race=race,
+        stream_verify=stream_verify,
+        validators=validators,
+        refresh_mirrors=refresh_mirrors,
+        offline=offline,
     )
     if not package_path:
         return False
+    if package_path is True:
+        print(f"{color.GREEN}julia latest is up to date.{color.END}")
+        return True
 
     if package_path.endswith(".dmg"):
         installer = install_julia_dmg
@@ -411,7 +479,12 @@ def install_julia(
         print(f"{color.RED}Unsupported file format for {package_path}{color.END}.")
 
     print(f"{color.BOLD}----- Install Julia -----{color.END}")
+    if validators is not None:
+        # forget the previous nightly build until the new one is installed
+        write_nightly_validators(install_dir, dict())
     installer(package_path, install_dir, symlink_dir, version, upgrade, skip_symlinks)
+    if validators is not None:
+        write_nightly_validators(install_dir, validators)
 
     if not keep_downloads:
         print(f"{color.BOLD}----- Post Installation -----{color.END}")
@@ -0,0 +1,227 @@
+from jill.utils.catalog_utils import CatalogFile, CatalogUnavailable, VersionsCache
+from jill.utils.catalog_utils import catalog_files, content_hash
+from jill.utils.catalog_utils import read_snapshot, write_snapshot
+from jill.utils.catalog_utils import validate_catalog
+from jill.utils.version_utils import update_catalog
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from jsonschema.exceptions import ValidationError
+from types import SimpleNamespace
+from unittest import mock
+import contextlib
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+
+def release(version, stable=True, sha256="ab" * 32):
+    file = {
+        "os": "linux",
+        "arch": "x86_64",
+        "triplet": "x86_64-linux-gnu",
+        "url": f"https://example.com/julia-{version}-linux-x86_64.tar.gz",
+        "size": 123456789,
+        "sha256": sha256,
+        "kind": "archive",
+        "extension": "tar.gz",
+        "version": version,
+    }
+    return {"stable": stable, "files": [file]}
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, "versions-cache.snapshot")
+
+    def test_roundtrip(self):
+        versions = {
+            "1.6.0": release("1.6.0"),
+            "1.6.0-rc1": release("1.6.0-rc1", stable=False),
+            # releases without checksum stay without checksum
+            "1.7.0": release("1.7.0", sha256=""),
+        }
+        versions["1.6.0"]["files"].append(
+            dict(versions["1.6.0"]["files"][0], os="mac", sha256="0" * 64)
+        )
+        files = list(catalog_files(versions))
+        checksum = content_hash(json.dumps(versions).encode())
+        write_snapshot(self.path, files, checksum)
+
+        snapshot = read_snapshot(self.path)
+        self.assertEqual(snapshot.checksum, checksum)
+        self.assertEqual(list(snapshot), files)
+        sha256 = [x.sha256 for x in snapshot]
+        self.assertEqual(sha256, ["ab" * 32, "0" * 64, "ab" * 32, ""])
+
+    def test_broken_snapshot(self):
+        self.assertIsNone(read_snapshot(self.path))
+        file = CatalogFile("1.6.0", "linux", "x86_64", "", True, "", 1, "")
+        write_snapshot(self.path, [file], "ab" * 32)
+        with open(self.path, "rb") as f:
+            content = f.read()
+        with open(self.path, "wb") as f:
+            f.write(content[:-1])
+        self.assertIsNone(read_snapshot(self.path))
+
+    def test_invalid_checksum(self):
+        for sha256 in ["not a checksum", "abcd"]:
+            file = CatalogFile("1.6.0", "linux", "x86_64", "", True, "", 1, sha256)
+            with self.subTest(sha256=sha256):
+                with self.assertRaises(ValueError):
+                    write_snapshot(self.path, [file], "ab" * 32)
+
+        # the catalog is still cached without its snapshot
+        versions = {"1.6.0": release("1.6.0", sha256="not a checksum")}
+        content = json.dumps(versions).encode()
+        path = os.path.join(self.tmpdir.name, "versions-cache.json")
+        cache = VersionsCache(path=path)
+        cache.update("https://example.com/versions.json", content, versions, {})
+        self.assertIsNone(cache.snapshot())
+        cache = VersionsCache(path=path)
+        self.assertEqual(cache.versions, versions)
+
+
+class TestValidateCatalog(unittest.TestCase):
+    schema = {
+        "type": "object",
+        "additionalProperties": {
+            "type": "object",
+            "required": ["stable", "files"],
+            "properties": {"stable": {"type": "boolean"}},
+        },
+    }
+
+    def test_validate(self):
+        validate_catalog({"1.6.0": release("1.6.0")}, self.schema)
+        with self.assertRaises(ValidationError):
+            validate_catalog({"1.6.0": {"stable": "yes", "files": []}}, self.schema)
+
+    def test_incremental(self):
+        # the validated catalog is trusted as it is, even if it's broken
+        broken = {"stable": "yes", "files": []}
+        validated = {"1.6.0": release("1.6.0"), "1.7.0": broken}
+        versions = {"1.6.0": release("1.6.0"), "1.7.0": dict(broken)}
+        validate_catalog(versions, self.schema, validated)
+        with self.assertRaises(ValidationError):
+            validate_catalog(versions, self.schema)
+
+        # changed releases are validated
+        changed = dict(versions, **{"1.6.0": dict(release("1.6.0"), stable="no")})
+        with self.assertRaises(ValidationError):
+            validate_catalog(changed, self.schema, validated)
+
+        # new releases are validated
+        added = dict(versions, **{"1.8.0": {"stable": True}})
+        with self.assertRaises(ValidationError):
+            validate_catalog(added, self.schema, validated)
+        added["1.8.0"] = release("1.8.0")
+        validate_catalog(added, self.schema, validated)
+
+
+class CatalogHandler(BaseHTTPRequestHandler):
+    """serve `server.content` as versions.json, with ETag support"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        etag = '"%s"' % content_hash(self.server.content)
+        if self.headers.get("If-None-Match", None) == etag:
+            status, body = 304, b""
+        else:
+            status, body = 200, self.server.content
+        self.server.requests.append(status)
+        self.send_response(status)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TestUpdateCatalog(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), CatalogHandler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f"http://127.0.0.1:{cls.server.server_address[1]}/versions.json"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, "versions-cache.json")
+        self.versions = {"1.6.0": release("1.6.0")}
+        self.server.content = json.dumps(self.versions).encode()
+        self.server.requests = []
+        registry = {"Local": SimpleNamespace(versions_url=self.url)}
+        patcher = mock.patch(
+            "jill.utils.version_utils.read_registry", return_value=registry
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def update(self, ttl=0, offline=False):
+        """run `update_catalog` like a new jill process would"""
+        catalog = VersionsCache(path=self.path, ttl=ttl)
+        catalog.offline = offline
+        with mock.patch(
+            "jill.utils.version_utils.versions_cache", return_value=catalog
+        ), contextlib.redirect_stdout(io.StringIO()):
+            return update_catalog("Local", cache=dict())
+
+    def test_download(self):
+        catalog = self.update()
+        self.assertEqual(catalog.versions, self.versions)
+        self.assertEqual(self.server.requests, [200])
+        self.assertIsNotNone(catalog.snapshot())
+
+        # the cached catalog is used as it is until the ttl expires
+        catalog = self.update(ttl=3600)
+        self.assertEqual(catalog.versions, self.versions)
+        self.assertEqual(self.server.requests, [200])
+
+    def test_revalidate(self):
+        self.update()
+        catalog = VersionsCache(path=self.path)
+        checked = catalog.record["time"]
+
+        # an unchanged catalog isn't downloaded again
+        catalog = self.update()
+        self.assertEqual(self.server.requests, [200, 304])
+        self.assertEqual(catalog.versions, self.versions)
+        self.assertGreater(VersionsCache(path=self.path).record["time"], checked)
+
+        # a changed catalog is
+        self.versions["1.7.0"] = release("1.7.0")
+        self.server.content = json.dumps(self.versions).encode()
+        catalog = self.update()
+        self.assertEqual(self.server.requests, [200, 304, 200])
+        self.assertEqual(catalog.versions, self.versions)
+        self.assertEqual(VersionsCache(path=self.path).versions, self.versions)
+
+    def test_offline(self):
+        with self.assertRaises(CatalogUnavailable):
+            self.update(offline=True)
+        self.assertEqual(self.server.requests, [])
+
+        self.update()
+        # the expired cache is used without asking the server
+        catalog = self.update(offline=True)
+        self.assertEqual(catalog.versions, self.versions)
+        self.assertEqual(self.server.requests, [200])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,436 @@
+from jill.download import download_package
+from jill.install import install_julia, read_nightly_validators
+from jill.utils.mirror_utils import MirrorCache
+from jill.utils.net_utils import download, DownloadCancelled, DownloadCorrupted
+from jill.utils.net_utils import _StallMonitor
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+import contextlib
+import functools
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+CONTENT = os.urandom(6 * 1024 * 1024 + 12345)
+CHUNK_SIZE = 64 * 1024
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """
+    serve `CONTENT` under any path with range support except paths under `/missing`.
+    `?delay=<seconds>` sleeps after each chunk of the response body. A request with
+    the current ETag in `If-None-Match` gets a 304.
+    """
+
+    protocol_version = "HTTP/1.1"
+    etag = '"%s"' % hashlib.md5(CONTENT).hexdigest()
+
+    def log_message(self, *args):
+        pass
+
+    def _respond(self):
+        self.server.requests.append((self.command, self.headers.get("Range", None)))
+        if self.path.startswith("/missing"):
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return b""
+        if self.headers.get("If-None-Match", None) == self.etag:
+            self.send_response(304)
+            self.send_header("ETag", self.etag)
+            self.end_headers()
+            return b""
+        start, end, status = 0, len(CONTENT) - 1, 200
+        byte_range = self.headers.get("Range", None)
+        if_range = self.headers.get("If-Range", None)
+        if byte_range and if_range in [None, self.etag]:
+            first, last = byte_range.split("=")[1].split("-")
+            start = int(first)
+            end = min(int(last), end) if last else end
+            status = 206
+        self.send_response(status)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", self.etag)
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(CONTENT)}")
+        self.end_headers()
+        return CONTENT[start : end + 1]
+
+    def do_HEAD(self):
+        self._respond()
+
+    def do_GET(self):
+        body = self._respond()
+        delay = float(parse_qs(urlparse(self.path).query).get("delay", ["0"])[0])
+        try:
+            for i in range(0, len(body), CHUNK_SIZE):
+                self.wfile.write(body[i : i + CHUNK_SIZE])
+                time.sleep(delay)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def start_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    server.daemon_threads = True
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class CancelAfter:
+    """a sink that sets `cancel` once `size` bytes of the file are downloaded"""
+
+    def __init__(self, cancel, size):
+        self.cancel = cancel
+        self.size = size
+        self.received = 0
+
+    def update(self, chunk):
+        self.received += len(chunk)
+        if self.received >= self.size:
+            self.cancel.set()
+
+
+class TestDownload(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.servers = [start_server(), start_server()]
+        cls.hosts = [f"127.0.0.1:{x.server_address[1]}" for x in cls.servers]
+
+    @classmethod
+    def tearDownClass(cls):
+        for server in cls.servers:
+            server.shutdown()
+            server.server_close()
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.outpath = os.path.join(self.tmpdir.name, "julia.tar.gz")
+        self.cache = MirrorCache(path=os.path.join(self.tmpdir.name, "mirrors.json"))
+        patcher = mock.patch(
+            "jill.utils.net_utils.mirror_cache", return_value=self.cache
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmpdir.cleanup)
+        for server in self.servers:
+            server.requests.clear()
+
+    def url(self, index=0, query="", path="/julia.tar.gz"):
+        return f"http://{self.hosts[index]}{path}{query}"
+
+    def stall_below(self, kbps):
+        """transfers slower than `kbps` KB/s for half a second stall"""
+        env = mock.patch.dict(os.environ, {"JILL_MIN_THROUGHPUT": str(kbps)})
+        monitor = mock.patch(
+            "jill.utils.net_utils._StallMonitor",
+            functools.partial(_StallMonitor, window=0.5),
+        )
+        for patcher in [env, monitor]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def ranges(self, index=0):
+        server = self.servers[index]
+        return [x for method, x in server.requests if method == "GET" and x]
+
+    def files(self):
+        return sorted(x for x in os.listdir(self.tmpdir.name) if x != "mirrors.json")
+
+    def assertDownloaded(self):
+        self.assertTrue(os.path.isfile(self.outpath))
+        with open(self.outpath, "rb") as f:
+            self.assertEqual(f.read(), CONTENT)
+        self.assertEqual(self.files(), ["julia.tar.gz"])
+
+    def test_single_stream(self):
+        download(self.url(), self.outpath)
+        self.assertDownloaded()
+        self.assertEqual(self.ranges(), [])
+
+    def test_segments(self):
+        download(self.url(), self.outpath, segments=4)
+        self.assertDownloaded()
+        starts = sorted(int(x.split("=")[1].split("-")[0]) for x in self.ranges())
+        self.assertEqual(len(starts), 4)
+        self.assertEqual(starts[0], 0)
+
+    def test_resume(self):
+        cancel = threading.Event()
+        sink = CancelAfter(cancel, 2 * 1024 * 1024)
+        with self.assertRaises(DownloadCancelled):
+            download(
+                self.url(query="?delay=0.01"),
+                self.outpath,
+                resume=True,
+                cancel=cancel,
+                sinks=[sink],
+            )
+        self.assertFalse(os.path.exists(self.outpath))
+        self.assertTrue(os.path.isfile(self.outpath + ".part"))
+        self.assertTrue(os.path.isfile(self.outpath + ".part.json"))
+
+        self.servers[0].requests.clear()
+        download(self.url(query="?delay=0.01"), self.outpath, resume=True)
+        self.assertDownloaded()
+        # only the missing bytes are downloaded again
+        (byte_range,) = self.ranges()
+        start = int(byte_range.split("=")[1].split("-")[0])
+        self.assertGreaterEqual(start, 2 * 1024 * 1024)
+
+    def test_size_mismatch(self):
+        with self.assertRaises(DownloadCorrupted):
+            download(self.url(), self.outpath, size=len(CONTENT) - 1)
+        self.assertEqual(self.files(), [])
+
+    def test_sha256_mismatch(self):
+        sha256 = hashlib.sha256(CONTENT).hexdigest()
+        download(self.url(), self.outpath, segments=4, sha256=sha256)
+        self.assertDownloaded()
+        os.remove(self.outpath)
+
+        with self.assertRaises(DownloadCorrupted):
+            download(self.url(), self.outpath, segments=4, sha256="0" * 64)
+        self.assertFalse(os.path.exists(self.outpath))
+
+        # a corrupted download is not resumed
+        with self.assertRaises(DownloadCorrupted):
+            download(self.url(), self.outpath, resume=True, sha256="0" * 64)
+        self.assertFalse(os.path.exists(self.outpath + ".part"))
+        self.assertFalse(os.path.exists(self.outpath + ".part.json"))
+
+    def test_stall_failover(self):
+        # each connection of the slow host gets about 320 KB/s
+        self.stall_below(2048)
+        for segments in [1, 4]:
+            with self.subTest(segments=segments):
+                self.cache.records.clear()
+                download(
+                    self.url(0, "?delay=0.2"),
+                    self.outpath,
+                    segments=segments,
+                    fallbacks=[self.url(1)],
+                )
+                self.assertDownloaded()
+                os.remove(self.outpath)
+
+                # the stalled host counts as one failure however many segments stall
+                slow, fast = (self.cache.records.get(x, {}) for x in self.hosts)
+                self.assertEqual(slow.get("failures", None), 1)
+                self.assertNotIn("throughput", slow)
+                self.assertEqual(fast.get("failures", None), 0)
+
+    def test_stall_segments(self):
+        # the throughput floor applies to the whole transfer: each of the 4 segments
+        # only gets about 1.2 MB/s, but the transfer gets about 5 MB/s
+        self.stall_below(2048)
+        download(
+            self.url(0, "?delay=0.05"),
+            self.outpath,
+            segments=4,
+            fallbacks=[self.url(1)],
+        )
+        self.assertDownloaded()
+        self.assertEqual(self.servers[1].requests, [])
+        self.assertEqual(self.cache.records[self.hosts[0]]["failures"], 0)
+
+    def test_stall_without_fallback(self):
+        # fallbacks that don't have the file are skipped, and the download continues
+        # from the slow host
+        self.stall_below(2048)
+        download(
+            self.url(0, "?delay=0.04"),
+            self.outpath,
+            fallbacks=[self.url(1, path="/missing/julia.tar.gz")],
+        )
+        self.assertDownloaded()
+        self.assertEqual(self.servers[1].requests, [("HEAD", None)])
+        self.assertEqual(len(self.ranges(0)), 1)
+
+    def test_race(self):
+        slow, fast = self.url(0, "?delay=0.2"), self.url(1)
+        download(slow, self.outpath, racers=[fast])
+        self.assertDownloaded()
+        # the whole file comes from the fast racer
+        self.assertIn(("GET", None), self.servers[1].requests)
+        self.assertEqual(self.ranges(0), [])
+        self.assertEqual(self.ranges(1), [])
+
+    def test_race_resume(self):
+        slow, fast = self.url(0, "?delay=0.2"), self.url(1, "?delay=0.01")
+        cancel = threading.Event()
+        sink = CancelAfter(cancel, 2 * 1024 * 1024)
+        with self.assertRaises(DownloadCancelled):
+            download(
+                slow,
+                self.outpath,
+                racers=[fast],
+                resume=True,
+                cancel=cancel,
+                sinks=[sink],
+            )
+        # the state is kept under the requested url, but records the winner
+        with open(self.outpath + ".part.json") as f:
+            state = json.load(f)
+        self.assertEqual(state["url"], slow)
+        self.assertEqual(state["source"], fast)
+
+        for server in self.servers:
+            server.requests.clear()
+        download(slow, self.outpath, racers=[fast], resume=True)
+        self.assertDownloaded()
+        # the resumed download continues from the winner
+        self.assertEqual(self.servers[0].requests, [])
+        (byte_range,) = self.ranges(1)
+        start = int(byte_range.split("=")[1].split("-")[0])
+        self.assertGreaterEqual(start, 2 * 1024 * 1024)
+
+    def test_striped(self):
+        download(self.url(0), self.outpath, mirrors=[self.url(1)])
+        self.assertDownloaded()
+        # both hosts serve a part of the file
+        self.assertTrue(self.ranges(0))
+        self.assertTrue(self.ranges(1))
+        for host in self.hosts:
+            self.assertEqual(self.cache.records[host]["failures"], 0)
+
+
+class TestNightly(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = start_server()
+        cls.url = f"http://127.0.0.1:{cls.server.server_address[1]}/julia.tar.gz"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.outpath = os.path.join(self.tmpdir.name, "julia.tar.gz")
+        self.install_dir = os.path.join(self.tmpdir.name, "julias")
+        os.makedirs(self.install_dir)
+        self.server.requests.clear()
+
+        # serve the nightly build from the local server instead of the upstreams
+        self.registry = mock.Mock()
+        self.registry.query_download_url.return_value = self.url
+        self.registry.query_mirror_urls.return_value = []
+        cache = MirrorCache(path=os.path.join(self.tmpdir.name, "mirrors.json"))
+        patchers = [
+            mock.patch("jill.download.SourceRegistry", return_value=self.registry),
+            mock.patch("jill.download.latest_version", return_value="latest"),
+            mock.patch("jill.download.is_version_released", return_value=True),
+            mock.patch("jill.download.query_release_file", return_value=None),
+            mock.patch("jill.utils.net_utils.mirror_cache", return_value=cache),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def download(self, validators):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return download_package(
+                "latest", "winnt", "x86_64", outdir=self.tmpdir.name, **validators
+            )
+
+    def install(self, installer):
+        # install_julia downloads into the working directory
+        cwd = os.getcwd()
+        os.chdir(self.tmpdir.name)
+        with contextlib.ExitStack() as stack:
+            stack.callback(os.chdir, cwd)
+            for patcher in [
+                mock.patch("jill.install.current_system", return_value="winnt"),
+                mock.patch("jill.install.current_architecture", return_value="x86_64"),
+                mock.patch("jill.install.is_installed", return_value=False),
+                mock.patch("jill.install.install_julia_tarball", installer),
+                contextlib.redirect_stdout(io.StringIO()),
+            ]:
+                stack.enter_context(patcher)
+            return install_julia(
+                "latest",
+                install_dir=self.install_dir,
+                symlink_dir=os.path.join(self.tmpdir.name, "bin"),
+                confirm=True,
+            )
+
+    def requests(self):
+        return [method for method, _ in self.server.requests]
+
+    def test_not_modified(self):
+        validators = dict()
+        self.assertEqual(self.download(dict(validators=validators)), self.outpath)
+        self.assertEqual(validators["url"], self.url)
+        self.assertEqual(validators["etag"], RangeHandler.etag)
+        os.remove(self.outpath)
+
+        self.server.requests.clear()
+        self.assertIs(self.download(dict(validators=validators)), True)
+        self.assertEqual(self.requests(), ["HEAD"])
+        self.assertFalse(os.path.exists(self.outpath))
+
+        # `jill download` doesn't pass validators and always gets the file
+        self.assertEqual(self.download(dict()), self.outpath)
+        self.assertIn("GET", self.requests())
+
+    def test_modified(self):
+        validators = dict(url=self.url, etag='"a previous build"')
+        self.assertEqual(self.download(dict(validators=validators)), self.outpath)
+        self.assertEqual(self.requests(), ["HEAD", "GET"])
+        self.assertEqual(validators["etag"], RangeHandler.etag)
+
+    def test_url_changed(self):
+        # validators are only sent to the server that issued them
+        validators = dict(url=self.url, etag=RangeHandler.etag)
+        url = self.url + "?build=2"
+        self.registry.query_download_url.return_value = url
+        self.assertEqual(self.download(dict(validators=validators)), self.outpath)
+        self.assertEqual(self.requests(), ["GET"])
+        self.assertEqual(validators["url"], url)
+
+    def test_install(self):
+        installer = mock.Mock(side_effect=RuntimeError("broken installer"))
+        with self.assertRaises(RuntimeError):
+            self.install(installer)
+        self.assertEqual(installer.call_count, 1)
+        # a failed installation doesn't record the validators
+        self.assertEqual(read_nightly_validators(self.install_dir), dict())
+
+        installer = mock.Mock()
+        self.install(installer)
+        self.assertEqual(installer.call_count, 1)
+        validators = read_nightly_validators(self.install_dir)
+        self.assertEqual(validators["etag"], RangeHandler.etag)
+        self.assertFalse(os.path.exists(self.outpath))
+
+        # the installed build is up to date
+        os.makedirs(os.path.join(self.install_dir, "julia-latest"))
+        self.server.requests.clear()
+        self.assertIs(self.install(installer), True)
+        self.assertEqual(installer.call_count, 1)
+        self.assertEqual(self.requests(), ["HEAD"])
+
+        # a new build is downloaded, and the previous validators are dropped until
+        # it's installed
+        installer.side_effect = RuntimeError("broken installer")
+        with mock.patch.object(RangeHandler, "etag", '"a new build"'):
+            with self.assertRaises(RuntimeError):
+                self.install(installer)
+        self.assertEqual(installer.call_count, 2)
+        self.assertEqual(read_nightly_validators(self.install_dir), dict())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+from jill.download import _download_and_verify
+from jill.utils.gpg_utils import GPGStreamVerifier, verify_gpg
+
+from gnupg import GPG
+from unittest import mock
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+CHUNK_SIZE = 64 * 1024
+
+
+class TestGPGStreamVerifier(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # a throwaway key instead of the Julia release key
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        gnupghome = os.path.join(cls.tmpdir.name, "gnupg")
+        os.mkdir(gnupghome)
+        gpg = GPG(gnupghome=gnupghome)
+        key = gpg.gen_key(
+            gpg.gen_key_input(
+                key_type="EDDSA",
+                key_curve="ed25519",
+                name_email="jill-tests@example.com",
+                no_protection=True,
+            )
+        )
+        cls.keyfile = os.path.join(cls.tmpdir.name, "key.asc")
+        with open(cls.keyfile, "w") as f:
+            f.write(gpg.export_keys(key.fingerprint))
+
+        cls.content = os.urandom(1024 * 1024 + 123)
+        cls.datafile = os.path.join(cls.tmpdir.name, "julia.tar.gz")
+        with open(cls.datafile, "wb") as f:
+            f.write(cls.content)
+        cls.signature_file = cls.datafile + ".asc"
+        with open(cls.datafile, "rb") as f:
+            gpg.sign_file(f, detach=True, output=cls.signature_file)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmpdir.cleanup()
+
+    def setUp(self):
+        patcher = mock.patch("jill.utils.gpg_utils.GPG_PUBLIC_KEY_PATH", self.keyfile)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def stream_verify(self, content, signature_file=None):
+        with GPGStreamVerifier(signature_file or self.signature_file) as verifier:
+            for i in range(0, len(content), CHUNK_SIZE):
+                verifier.update(content[i : i + CHUNK_SIZE])
+            return verifier.result()
+
+    def test_verify(self):
+        self.assertTrue(self.stream_verify(self.content))
+        self.assertTrue(verify_gpg(self.datafile))
+
+    def test_tampered(self):
+        content = bytearray(self.content)
+        content[len(content) // 2] ^= 0xFF
+        self.assertFalse(self.stream_verify(bytes(content)))
+        self.assertFalse(self.stream_verify(self.content[:-1]))
+
+    def test_broken_signature(self):
+        signature_file = os.path.join(self.tmpdir.name, "broken.asc")
+        with open(signature_file, "w") as f:
+            f.write("not a signature")
+        self.assertFalse(self.stream_verify(self.content, signature_file))
+
+    def test_gpg_missing(self):
+        tmpdirs = []
+
+        def _tmpdir():
+            tmpdirs.append(tempfile.TemporaryDirectory())
+            return tmpdirs[-1]
+
+        with mock.patch(
+            "jill.utils.gpg_utils.GPG", side_effect=OSError("Unable to run gpg")
+        ), mock.patch("jill.utils.gpg_utils.TemporaryDirectory", _tmpdir):
+            with self.assertRaises(OSError):
+                GPGStreamVerifier(self.signature_file).__enter__()
+        self.assertEqual(len(tmpdirs), 1)
+        self.assertFalse(os.path.exists(tmpdirs[0].name))
+
+    def test_download_without_gpg(self):
+        # the package is still downloaded, and verified after the download
+        outpath = os.path.join(self.tmpdir.name, "download.tar.gz")
+        calls = []
+
+        def _download(url, out, **kwargs):
+            calls.append((url, out, kwargs))
+            return out
+
+        with mock.patch("jill.download._download", _download), mock.patch(
+            "jill.utils.gpg_utils.GPG", side_effect=OSError("Unable to run gpg")
+        ), contextlib.redirect_stdout(io.StringIO()):
+            rst = _download_and_verify("https://example.com/julia.tar.gz", outpath, {})
+        self.assertEqual(rst, (outpath, outpath + ".asc", None))
+        self.assertEqual([x[1] for x in calls], [outpath + ".asc", outpath])
+        self.assertNotIn("sinks", calls[1][2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+from jill.utils.net_utils import _NetworkMemo
+from jill.utils.net_utils import response_times
+
+from unittest import mock
+import socket
+import unittest
+
+
+class TestResponseTimes(unittest.TestCase):
+    def setUp(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(8)
+        self.addCleanup(self.listener.close)
+        self.port = self.listener.getsockname()[1]
+
+        # a port that refuses connections
+        closed = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        closed.bind(("127.0.0.1", 0))
+        self.closed_port = closed.getsockname()[1]
+        closed.close()
+
+        # measurements are memoized in the process
+        patcher = mock.patch(
+            "jill.utils.net_utils.network_memo", return_value=_NetworkMemo()
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_response_times(self):
+        reachable = ("127.0.0.1", self.port)
+        refused = ("127.0.0.1", self.closed_port)
+        unresolved = ("host.invalid", 443)
+        records = response_times([reachable, refused, unresolved], timeout=1)
+        self.assertLess(records[reachable], 1)
+        self.assertEqual(records[refused], 10)
+        self.assertEqual(records[unresolved], 10)
+
+    def test_timeouts(self):
+        endpoints = [("127.0.0.1", self.port), ("127.0.0.1", self.closed_port)]
+        records = response_times(endpoints, dict(zip(endpoints, [1, 2])))
+        self.assertLess(records[endpoints[0]], 1)
+        self.assertEqual(records[endpoints[1]], 20)
+
+    def test_unsupported_family(self):
+        # the IPv6 address can't even get a socket, e.g., IPv6 is disabled in the
+        # kernel, the IPv4 address is tried instead
+        addresses = [
+            (socket.AF_INET6, ("::1", self.port, 0, 0)),
+            (socket.AF_INET, ("127.0.0.1", self.port)),
+        ]
+        real_socket = socket.socket
+
+        def _socket(family, *args, **kwargs):
+            if family == socket.AF_INET6:
+                raise OSError(97, "Address family not supported by protocol")
+            return real_socket(family, *args, **kwargs)
+
+        endpoint = ("localhost", self.port)
+        with mock.patch(
+            "jill.utils.net_utils.query_addresses", return_value=addresses
+        ), mock.patch("jill.utils.net_utils.socket.socket", _socket):
+            records = response_times([endpoint], timeout=1)
+        self.assertLess(records[endpoint], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
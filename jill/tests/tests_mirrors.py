@@ -0,0 +1,114 @@
+from jill.utils.mirror_utils import MirrorCache
+from jill.utils.mirror_utils import BREAKER_COOLDOWN, BREAKER_MAX_COOLDOWN
+from jill.utils.mirror_utils import BREAKER_THRESHOLD, EWMA_ALPHA
+
+from unittest import mock
+import os
+import tempfile
+import unittest
+
+HOST = "mirror.example.com"
+
+
+class TestMirrorCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, "mirrors.json")
+        self.now = 1000000.0
+        patcher = mock.patch("jill.utils.mirror_utils.time.time", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = MirrorCache(path=self.path, ttl=60)
+
+    def test_breaker_threshold(self):
+        for _ in range(BREAKER_THRESHOLD - 1):
+            self.cache.record_failure(HOST)
+            self.assertTrue(self.cache.is_available(HOST))
+        self.cache.record_failure(HOST)
+        self.assertFalse(self.cache.is_available(HOST))
+        # other hosts are not affected
+        self.assertTrue(self.cache.is_available("other.example.com"))
+
+        # the host gets another chance once the cooldown expires
+        self.now += BREAKER_COOLDOWN
+        self.assertTrue(self.cache.is_available(HOST))
+
+        # the breaker state is persisted
+        self.now -= 1
+        self.assertFalse(MirrorCache(path=self.path).is_available(HOST))
+
+    def test_breaker_cooldown(self):
+        for _ in range(BREAKER_THRESHOLD - 1):
+            self.cache.record_failure(HOST)
+        cooldowns = []
+        for _ in range(10):
+            self.cache.record_failure(HOST)
+            cooldowns.append(self.cache.records[HOST]["open_until"] - self.now)
+        expected = [BREAKER_COOLDOWN * 2**n for n in range(10)]
+        expected = [min(x, BREAKER_MAX_COOLDOWN) for x in expected]
+        self.assertEqual(cooldowns, expected)
+        self.assertEqual(cooldowns[-1], BREAKER_MAX_COOLDOWN)
+
+    def test_breaker_reset(self):
+        for _ in range(BREAKER_THRESHOLD):
+            self.cache.record_failure(HOST)
+        self.assertFalse(self.cache.is_available(HOST))
+        self.cache.record_success(HOST)
+        self.assertTrue(self.cache.is_available(HOST))
+
+        # the failures in a row start again from zero
+        for _ in range(BREAKER_THRESHOLD - 1):
+            self.cache.record_failure(HOST)
+        self.assertTrue(self.cache.is_available(HOST))
+
+    def test_breaker_refresh(self):
+        for _ in range(BREAKER_THRESHOLD):
+            self.cache.record_failure(HOST)
+        self.cache.refresh()
+        self.assertTrue(self.cache.is_available(HOST))
+
+    def test_error_rate(self):
+        self.assertEqual(self.cache.error_rate(HOST), 0.0)
+        self.cache.record_failure(HOST)
+        self.assertEqual(self.cache.error_rate(HOST), 1.0)
+        self.cache.record_success(HOST)
+        self.assertAlmostEqual(self.cache.error_rate(HOST), 1 - EWMA_ALPHA)
+        self.cache.record_success(HOST)
+        self.assertAlmostEqual(self.cache.error_rate(HOST), (1 - EWMA_ALPHA) ** 2)
+
+    def test_throughput(self):
+        self.assertIsNone(self.cache.throughput(HOST))
+        self.assertIsNone(self.cache.score(HOST))
+        self.cache.record_success(HOST, 100.0)
+        self.assertEqual(self.cache.throughput(HOST), 100.0)
+        self.cache.record_success(HOST, 200.0)
+        expected = EWMA_ALPHA * 200 + (1 - EWMA_ALPHA) * 100
+        self.assertAlmostEqual(self.cache.throughput(HOST), expected)
+        # successes without throughput don't change it
+        self.cache.record_success(HOST)
+        self.assertAlmostEqual(self.cache.throughput(HOST), expected)
+        self.assertAlmostEqual(self.cache.score(HOST), expected)
+
+        # the score is discounted by the error rate
+        self.cache.record_failure(HOST)
+        error_rate = self.cache.error_rate(HOST)
+        self.assertGreater(error_rate, 0)
+        self.assertAlmostEqual(self.cache.score(HOST), expected * (1 - error_rate))
+
+        # the throughput expires after the ttl
+        self.now += 61
+        self.assertIsNone(self.cache.throughput(HOST))
+        self.assertIsNone(self.cache.score(HOST))
+
+    def test_score_order(self):
+        self.cache.record_success("fast.example.com", 1000.0)
+        self.cache.record_success("flaky.example.com", 1200.0)
+        for _ in range(2):
+            self.cache.record_failure("flaky.example.com")
+        hosts = ["flaky.example.com", "fast.example.com"]
+        self.assertEqual(max(hosts, key=self.cache.score), "fast.example.com")
+
+
+if __name__ == "__main__":
+    unittest.main()
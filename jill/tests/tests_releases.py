@@ -0,0 +1,190 @@
+from jill.utils.catalog_utils import catalog_files
+from jill.utils.version_utils import ReleaseCatalog, Version
+from jill.utils.version_utils import is_full_version
+from jill.utils.version_utils import is_version_released, latest_version
+
+from unittest import mock
+import contextlib
+import io
+import itertools
+import semantic_version
+import unittest
+
+TRIPLETS = {
+    ("linux", "x86_64"): "x86_64-linux-gnu",
+    ("linux", "aarch64"): "aarch64-linux-gnu",
+    ("musl", "x86_64"): "x86_64-linux-musl",
+    ("mac", "x86_64"): "x86_64-apple-darwin14",
+    ("winnt", "x86_64"): "x86_64-w64-mingw32",
+}
+
+
+def release(stable, *platforms):
+    files = []
+    for platform in platforms:
+        os, arch = platform
+        files.append(
+            {
+                # musl builds are tagged as linux in the catalog
+                "os": "linux" if os == "musl" else os,
+                "arch": arch,
+                "triplet": TRIPLETS[platform],
+                "url": f"https://example.com/{os}/{arch}/julia.tar.gz",
+                "size": 1,
+                "sha256": "",
+                "kind": "archive",
+                "extension": "tar.gz",
+            }
+        )
+    return {"stable": stable, "files": files}
+
+
+LINUX, ARM, MUSL = ("linux", "x86_64"), ("linux", "aarch64"), ("musl", "x86_64")
+MAC, WIN = ("mac", "x86_64"), ("winnt", "x86_64")
+
+# the catalog is deliberately not sorted
+VERSIONS = {
+    "1.6.0": release(True, LINUX, MUSL, MAC, WIN),
+    "0.5.2": release(True, LINUX, MAC),
+    "0.6.0": release(True, LINUX, MAC, WIN),
+    "1.10.0": release(True, LINUX, ARM, MAC),
+    "1.9.4": release(True, LINUX, ARM, MAC, WIN),
+    "1.6.0-rc1": release(False, LINUX, MAC, WIN),
+    "1.6.1": release(True, LINUX, ARM),
+    "1.5.0-beta1": release(False, LINUX, MUSL),
+    "1.5.4": release(True, LINUX, MUSL, MAC),
+    "1.11.0-rc2": release(False, LINUX, ARM, MUSL),
+    "1.11.0-alpha1": release(False, LINUX, WIN),
+    "1.12.0-beta1": release(False, MAC),
+}
+
+
+def reference_releases(versions, minimal_version="0.6.0", stable_only=False):
+    # the list-based `read_releases` that `ReleaseCatalog` replaces
+    releases = []
+    for ver, item in versions.items():
+        if not stable_only or item["stable"]:
+            try:
+                if Version(ver) < Version(minimal_version):
+                    continue
+            except:  # noqa: E722
+                continue
+            for file in item["files"]:
+                os = file["os"]
+                if file["triplet"].split("-")[2] == "musl":
+                    os = "musl"
+                releases.append((ver, os, file["arch"]))
+    return releases
+
+
+def reference_latest_version(versions, version, system, arch, **kwargs):
+    # the list-based `latest_version` that `ReleaseCatalog.latest` replaces
+    if is_full_version(version):
+        return version
+    releases = reference_releases(versions, **kwargs)
+    compat_releases = [x for x in releases if x[1] == system and x[2] == arch]
+    if len(compat_releases) == 0:
+        raise ValueError(f"no release for {system} and {arch}")
+    latest = max(compat_releases, key=lambda x: Version(x[0]))[0]
+    if len(version.strip()) == 0:
+        return latest
+    filtered_compat = [
+        x
+        for x in compat_releases
+        if Version(x[0]).minor_version == Version(version).minor_version
+    ]
+    if len(filtered_compat) == 0:
+        return latest
+    return max(filtered_compat, key=lambda x: Version(x[0]))[0]
+
+
+class TestReleaseCatalog(unittest.TestCase):
+    queries = [
+        dict(minimal_version=minimal_version, stable_only=stable_only)
+        for minimal_version, stable_only in itertools.product(
+            ["0.5.0", "0.6.0", "1.6.0", "1.6.1", "1.11.0-alpha1", "1.13.0"],
+            [False, True],
+        )
+    ]
+    platforms = list(TRIPLETS) + [("freebsd", "x86_64")]
+
+    def setUp(self):
+        self.catalog = ReleaseCatalog(catalog_files(VERSIONS))
+        patcher = mock.patch(
+            "jill.utils.version_utils.release_catalog", return_value=self.catalog
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_releases(self):
+        for query in self.queries:
+            with self.subTest(**query):
+                expected = reference_releases(VERSIONS, **query)
+                self.assertEqual(self.catalog.releases(**query), expected)
+
+    def test_is_released(self):
+        versions = list(VERSIONS) + ["1.6.2", "1.6", "latest"]
+        for query in self.queries:
+            releases = reference_releases(VERSIONS, **query)
+            for ver, (system, arch) in itertools.product(versions, self.platforms):
+                with self.subTest(version=ver, system=system, arch=arch, **query):
+                    expected = ver == "latest" or (ver, system, arch) in releases
+                    self.assertEqual(
+                        is_version_released(ver, system, arch, **query), expected
+                    )
+
+    def test_latest(self):
+        versions = ["", "0.6", "1", "1.5", "1.6", "1.7", "1.11", "1.12", "1.9.4"]
+        for query in self.queries:
+            for ver, (system, arch) in itertools.product(versions, self.platforms):
+                with self.subTest(version=ver, system=system, arch=arch, **query):
+                    try:
+                        expected = reference_latest_version(
+                            VERSIONS, ver, system, arch, **query
+                        )
+                    except ValueError:
+                        with self.assertRaises(ValueError):
+                            latest_version(ver, system, arch, **query)
+                        continue
+                    # partial versions without release fall back with a warning
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        result = latest_version(ver, system, arch, **query)
+                    self.assertEqual(result, expected)
+
+
+class TestSortKey(unittest.TestCase):
+    versions = [
+        "0.6.0",
+        "1.0.0",
+        "1.6.0-DEV",
+        "1.6.0-alpha",
+        "1.6.0-beta2",
+        "1.6.0-beta10",
+        "1.6.0-rc1",
+        "1.6.0-rc10",
+        "1.6.0-2",
+        "1.6.0-10",
+        "1.6.0",
+        "1.6.1",
+        "1.9.4",
+        "1.10.0-rc1",
+        "1.10.0",
+        "1.11.0-alpha1",
+        "2.0.0",
+    ]
+
+    def test_sort_key(self):
+        expected = sorted(self.versions, key=semantic_version.Version)
+        self.assertEqual(
+            sorted(self.versions, key=lambda x: Version(x).sort_key), expected
+        )
+        for x, y in itertools.product(self.versions, repeat=2):
+            with self.subTest(x=x, y=y):
+                a, b = semantic_version.Version(x), semantic_version.Version(y)
+                key_a, key_b = Version(x).sort_key, Version(y).sort_key
+                self.assertEqual(key_a < key_b, a < b)
+                self.assertEqual(key_a == key_b, a == b)
+
+
+if __name__ == "__main__":
+    unittest.main()
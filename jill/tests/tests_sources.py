@@ -0,0 +1,76 @@
+from jill.utils.source_utils import SourceRegistry, compile_template
+
+from string import Template
+from unittest import mock
+import unittest
+
+
+class TestCompileTemplate(unittest.TestCase):
+    configs = {
+        "version": "1.6.0",
+        "minor_version": "1.6",
+        "sys": "linux",
+        "arch": "x86_64",
+        "bit": 64,
+    }
+
+    def test_substitute(self):
+        templates = [
+            "",
+            "https://julialang-s3.julialang.org/bin/linux/x64/julia-latest.tar.gz",
+            "https://example.com/$sys/$arch/$minor_version/julia-$version.tar.gz",
+            "https://example.com/${sys}${bit}/julia-${version}-$arch.tar.gz",
+            "$version",
+            "${version}",
+            "$version$arch",
+            "price: $$5 for $$$version, $$",
+            "$$version is not a placeholder",
+            "${sys}_$$_${arch}",
+        ]
+        for template in templates:
+            with self.subTest(template=template):
+                self.assertEqual(
+                    compile_template(template)(self.configs),
+                    Template(template).substitute(self.configs),
+                )
+
+    def test_errors(self):
+        # missing placeholders are only found when the template is substituted
+        generate = compile_template("julia-$version-$os.tar.gz")
+        with self.assertRaises(KeyError):
+            generate(self.configs)
+        with self.assertRaises(KeyError):
+            Template("julia-$version-$os.tar.gz").substitute(self.configs)
+
+        for template in ["julia-$", "julia-${version", "julia-$1.6"]:
+            with self.subTest(template=template):
+                with self.assertRaises(ValueError):
+                    compile_template(template)
+                with self.assertRaises(ValueError):
+                    Template(template).substitute(self.configs)
+
+
+class TestSourceRegistry(unittest.TestCase):
+    urls = ["https://a.example.com/julia.tar.gz", "https://b.example.com/julia.tar.gz"]
+
+    def query_timeout(self, registry, **kwargs):
+        """return the timeout that `query_download_url` probes the urls with"""
+        with mock.patch.object(
+            SourceRegistry, "_get_urls", return_value=self.urls
+        ), mock.patch(
+            "jill.utils.source_utils.first_response", return_value=self.urls[0]
+        ) as probe:
+            url = registry.query_download_url("1.6.0", "linux", "x86_64", **kwargs)
+        self.assertEqual(url, self.urls[0])
+        return probe.call_args.kwargs["timeout"]
+
+    def test_timeout(self):
+        # the per-host timeouts are used by default
+        self.assertIsNone(self.query_timeout(SourceRegistry()))
+        self.assertEqual(self.query_timeout(SourceRegistry(timeout=5)), 5)
+        self.assertEqual(self.query_timeout(SourceRegistry(timeout=5), timeout=1), 1)
+        self.assertEqual(self.query_timeout(SourceRegistry(), timeout=1), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
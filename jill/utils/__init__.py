@@ -1,7 +1,11 @@
+from .catalog_utils import use_offline_catalog
+from .catalog_utils import CatalogUnavailable
 from .filters import generate_info
 from .gpg_utils import verify_gpg
+from .gpg_utils import GPGStreamVerifier
 from .interactive_utils import query_yes_no
 from .interactive_utils import color
+from .mirror_utils import refresh_mirrors
 from .mount_utils import TarMounter, DmgMounter
 from .sys_utils import current_architecture, current_system, current_libc
 from .sys_utils import show_verbose
@@ -10,18 +14,25 @@ from .version_utils import latest_version
 from .version_utils import is_version_released
 from .version_utils import is_full_version
 from .version_utils import read_releases
+from .version_utils import query_release_file
 from .source_utils import SourceRegistry
 from .source_utils import show_upstream
 from .source_utils import verify_upstream
 
 __all__ = [
+    # catalog_utils
+    "use_offline_catalog",
+    "CatalogUnavailable",
     # filters
     "generate_info",
     # gpg_utils
     "verify_gpg",
+    "GPGStreamVerifier",
     # interactive_utils
     "query_yes_no",
     "color",
+    # mirror_utils
+    "refresh_mirrors",
     # mount_utils
     "TarMounter",
     "DmgMounter",
@@ -36,6 +47,7 @@ __all__ = [
     "latest_version",
     "is_version_released",
     "read_releases",
+    "query_release_file",
     # source_utils
     "SourceRegistry",
     "show_upstream",
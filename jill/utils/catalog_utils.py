@@ -0,0 +1,331 @@
+"""
+This module keeps a local copy of the release catalog (`versions.json`) so that it
+doesn't need to be downloaded in every jill run.
+"""
+
+from .defaults import VERSIONS_CACHEFILE
+
+import hashlib
+import itertools
+import json
+import jsonschema
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+from collections import namedtuple
+
+# the cached catalog is used without asking the server for this many seconds
+DEFAULT_VERSIONS_CACHE_TTL = 60 * 60
+
+
+class CatalogUnavailable(Exception):
+    """the release catalog isn't cached and can't be downloaded in offline mode"""
+
+
+def versions_cache_ttl():
+    try:
+        return float(
+            os.environ.get("JILL_VERSIONS_CACHE_TTL", DEFAULT_VERSIONS_CACHE_TTL)
+        )
+    except ValueError:
+        return DEFAULT_VERSIONS_CACHE_TTL
+
+
+class VersionsCache:
+    """
+    the last downloaded release catalog together with its `ETag`/`Last-Modified`
+    validators. Once it's older than the TTL, it's revalidated with a conditional
+    request so the full catalog is only downloaded again if it's modified.
+
+    In offline mode the cached catalog is always used as it is.
+
+    Only catalogs that pass the schema validation are stored, `validated` is the
+    sha256 checksum of their content. The record is kept in `path`, the catalog is
+    kept next to it as it's downloaded, together with a binary snapshot of it (see
+    `write_snapshot`) so that release queries don't need to parse the catalog.
+    """
+
+    def __init__(self, path=VERSIONS_CACHEFILE, ttl=None):
+        self.path = path
+        root, _ = os.path.splitext(path)
+        self.data_path = root + ".data"
+        self.snapshot_path = root + ".snapshot"
+        self.ttl = versions_cache_ttl() if ttl is None else ttl
+        self.offline = False
+        self.record = self._load()
+        self._versions = None
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return dict()
+        return record if isinstance(record, dict) else dict()
+
+    @property
+    def versions(self):
+        """the cached catalog, or `None` if there isn't one"""
+        if self._versions is None and self.validated:
+            try:
+                with open(self.data_path, "rb") as f:
+                    content = f.read()
+                if content_hash(content) == self.validated:
+                    self._versions = json.loads(content)
+            except (OSError, ValueError):
+                pass
+            if self._versions is None:
+                # the cached copy is broken, download it again
+                self.record.pop("validated", None)
+        return self._versions
+
+    @property
+    def validated(self):
+        """the content checksum of the cached catalog if it's validated"""
+        return self.record.get("validated", None)
+
+    def has_versions(self):
+        return bool(self.validated) and os.path.isfile(self.data_path)
+
+    def is_fresh(self):
+        if not self.has_versions():
+            return False
+        return time.time() - self.record.get("time", 0) <= self.ttl
+
+    def validators(self, url):
+        """headers of the conditional request to check if `url` is modified"""
+        headers = dict()
+        if not self.has_versions() or self.record.get("url", None) != url:
+            return headers
+        if self.record.get("etag", None):
+            headers["If-None-Match"] = self.record["etag"]
+        if self.record.get("last_modified", None):
+            headers["If-Modified-Since"] = self.record["last_modified"]
+        return headers
+
+    def touch(self):
+        """mark the cached catalog as up to date"""
+        self.record["time"] = time.time()
+        self.save()
+
+    def update(self, url, content, versions, headers):
+        """
+        store the validated catalog `versions` downloaded from `url`, `content` is
+        the raw response body
+        """
+        _write_atomic(self.data_path, content)
+        self._versions = versions
+        self.record = {
+            "url": url,
+            "etag": headers.get("etag", None),
+            "last_modified": headers.get("last-modified", None),
+            "time": time.time(),
+            "validated": content_hash(content),
+        }
+        self.write_snapshot()
+        self.save()
+
+    def snapshot(self):
+        """
+        the snapshot of the cached catalog, or `None` if there isn't an up to date one
+        """
+        snapshot = read_snapshot(self.snapshot_path)
+        if snapshot is None or snapshot.checksum != self.validated:
+            return None
+        return snapshot
+
+    def write_snapshot(self):
+        versions = self.versions
+        if versions is None:
+            return
+        try:
+            write_snapshot(self.snapshot_path, catalog_files(versions), self.validated)
+        except (ValueError, struct.error):
+            # like other cache files the snapshot is optional, release queries fall
+            # back to the catalog itself
+            pass
+
+    def save(self):
+        _write_atomic(self.path, json.dumps(self.record).encode())
+
+
+def versions_cache(cache=dict()) -> VersionsCache:
+    """return the process-wide release catalog cache"""
+    if not cache:
+        cache["cache"] = VersionsCache()
+    return cache["cache"]
+
+
+def _write_atomic(path, content: bytes):
+    # the cache is only an optimization, failing to write it isn't an error
+    outdir = os.path.dirname(path)
+    try:
+        os.makedirs(outdir, exist_ok=True)
+        fd, tmppath = tempfile.mkstemp(dir=outdir, prefix=".versions.")
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmppath, path)
+    except OSError:
+        pass
+
+
+def use_offline_catalog():
+    """use the cached release catalog without checking for updates in this run"""
+    versions_cache().offline = True
+
+
+def content_hash(content: bytes):
+    return hashlib.sha256(content).hexdigest()
+
+
+def compile_schema(schema, cache=dict()):
+    """return the validator of `schema`, it's only checked and built once"""
+    key = content_hash(json.dumps(schema, sort_keys=True).encode())
+    if key not in cache:
+        cls = jsonschema.validators.validator_for(schema)
+        cls.check_schema(schema)
+        cache[key] = cls(schema)
+    return cache[key]
+
+
+def validate_catalog(versions, schema, validated=None):
+    """
+    validate the release catalog `versions` against `schema`. Releases that are the
+    same in the already validated catalog `validated` are not checked again.
+
+    Raises `jsonschema.exceptions.ValidationError` if it's not valid.
+    """
+    validator = compile_schema(schema)
+    if isinstance(versions, dict) and isinstance(validated, dict):
+        # each release is validated on its own against the schema of the catalog
+        versions = {k: v for k, v in versions.items() if validated.get(k, None) != v}
+    validator.validate(versions)
+
+
+# a release file of the catalog
+CatalogFile = namedtuple(
+    "CatalogFile",
+    ["version", "os", "arch", "triplet", "stable", "url", "size", "sha256"],
+)
+
+
+def catalog_files(versions):
+    """iterate over all release files of the catalog `versions` as `CatalogFile`"""
+    for ver, item in versions.items():
+        for file in item["files"]:
+            yield CatalogFile(
+                ver,
+                file["os"],
+                file["arch"],
+                file["triplet"],
+                item["stable"],
+                file["url"],
+                file["size"],
+                file["sha256"],
+            )
+
+
+# snapshot layout (little-endian):
+#   header: magic, sha256 of the catalog, number of records, number of strings
+#   string table: `n_strings + 1` offsets into the utf-8 encoded string blob
+#   records: version, os, arch, triplet and url as string indices, then size,
+#     stable, whether the release file has a sha256 checksum, and the raw checksum
+_SNAPSHOT_MAGIC = b"JILLCAT2"
+_SNAPSHOT_HEADER = struct.Struct("<8s32sII")
+_SNAPSHOT_RECORD = struct.Struct("<5IQ??32s")
+
+
+def _raw_sha256(checksum):
+    raw = bytes.fromhex(checksum)
+    if len(raw) != 32:
+        raise ValueError(f"invalid sha256 checksum: {checksum}")
+    return raw
+
+
+def write_snapshot(path, files, checksum):
+    """
+    write the release files `files` of the catalog with sha256 `checksum` to `path`
+
+    Raises `ValueError` or `struct.error` if a release file can't be stored, e.g., its
+    checksum isn't a sha256 hex digest.
+    """
+    strings, records = dict(), []
+    for file in files:
+        indices = [
+            strings.setdefault(x, len(strings))
+            for x in (file.version, file.os, file.arch, file.triplet, file.url)
+        ]
+        has_sha256 = bool(file.sha256)
+        sha256 = _raw_sha256(file.sha256) if has_sha256 else bytes(32)
+        records.append(
+            _SNAPSHOT_RECORD.pack(*indices, file.size, file.stable, has_sha256, sha256)
+        )
+
+    blobs = [x.encode() for x in strings]
+    offsets = list(itertools.accumulate((len(x) for x in blobs), initial=0))
+    content = b"".join(
+        [
+            _SNAPSHOT_HEADER.pack(
+                _SNAPSHOT_MAGIC, _raw_sha256(checksum), len(records), len(blobs)
+            ),
+            struct.pack(f"<{len(offsets)}I", *offsets),
+            b"".join(blobs),
+            b"".join(records),
+        ]
+    )
+    _write_atomic(path, content)
+
+
+class CatalogSnapshot:
+    """
+    the release files stored in a snapshot file, see `write_snapshot`
+    """
+
+    def __init__(self, buffer):
+        magic, checksum, n_records, n_strings = _SNAPSHOT_HEADER.unpack_from(buffer)
+        if magic != _SNAPSHOT_MAGIC:
+            raise ValueError("not a catalog snapshot")
+        self.checksum = checksum.hex()
+
+        start = _SNAPSHOT_HEADER.size
+        offsets = struct.unpack_from(f"<{n_strings + 1}I", buffer, start)
+        start += 4 * (n_strings + 1)
+        blob = buffer[start : start + offsets[-1]]
+        strings = [blob[i:j].decode() for i, j in zip(offsets, offsets[1:])]
+
+        start += offsets[-1]
+        end = start + n_records * _SNAPSHOT_RECORD.size
+        if end != len(buffer):
+            raise ValueError("truncated catalog snapshot")
+        self.files = [
+            CatalogFile(
+                strings[ver],
+                strings[os],
+                strings[arch],
+                strings[triplet],
+                stable,
+                strings[url],
+                size,
+                sha256.hex() if has_sha256 else "",
+            )
+            for ver, os, arch, triplet, url, size, stable, has_sha256, sha256 in (
+                _SNAPSHOT_RECORD.iter_unpack(buffer[start:end])
+            )
+        ]
+
+    def __iter__(self):
+        return iter(self.files)
+
+
+def read_snapshot(path):
+    """return the `CatalogSnapshot` in `path`, or `None` if it's missing or broken"""
+    try:
+        with open(path, "rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as buffer:
+            return CatalogSnapshot(buffer)
+    except (OSError, ValueError, IndexError, UnicodeDecodeError, struct.error):
+        return None
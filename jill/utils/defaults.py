@@ -29,6 +29,10 @@ def get_configfiles(filename):
 
 
 SOURCE_CONFIGFILE = get_configfiles("sources.json")
+# measured network performance of mirror hosts, kept next to the user sources.json
+MIRROR_CACHEFILE = get_configfiles("mirrors.json")[0]
+# the last downloaded versions.json and its ETag/Last-Modified
+VERSIONS_CACHEFILE = get_configfiles("versions-cache.json")[0]
 GPG_PUBLIC_KEY_PATH = os.path.join(PKG_ROOT, ".gnupg", "juliareleases.asc")
 DEFAULT_VERSIONS_URL = "https://julialang-s3.julialang.org/bin/versions.json"
 VERSIONS_SCHEMA_URL = "https://julialang-s3.julialang.org/bin/versions-schema.json"
@@ -5,8 +5,8 @@ Module `filters` defines placeholders and how names are filtered.
 from .defaults import default_filename_template
 from .defaults import default_latest_filename_template
 from .defaults import load_placeholder, load_alias
+from .net_utils import http_client
 from semantic_version import Version
-import httpx
 import json
 
 import re
@@ -175,8 +175,7 @@ def _build(ver, cache={}):
         return cache[build]
     try:
         github_api = f"https://api.github.com/repos/julialang/julia/commits/{build}"
-        with httpx.Client(follow_redirects=True) as client:
-            data = json.loads(client.get(github_api).content)
+        data = json.loads(http_client().get(github_api).content)
         cache[build] = data["sha"][0:10]
         return cache[build]
     except:
@@ -3,6 +3,7 @@ from .sys_utils import current_system
 
 from gnupg import GPG
 from tempfile import TemporaryDirectory
+import subprocess
 import warnings
 import shutil
 
@@ -48,3 +49,84 @@ def verify_gpg(datafile, signature_file=None) -> bool:
         pass
     finally:
         return rst
+
+
+def _cleanup(tmpdir: TemporaryDirectory):
+    try:
+        tmpdir.cleanup()
+    except FileNotFoundError:
+        # issue #45
+        pass
+
+
+class GPGStreamVerifier:
+    """
+    Verify Julia releases using GPG while they are being downloaded.
+
+    The data is piped into a running `gpg --verify` process chunk by chunk via
+    `update`, so the result is available right after the last chunk arrives and the
+    file doesn't need to be read again from disk.
+
+    Example:
+
+        with GPGStreamVerifier(signature_file) as verifier:
+            download(url, outpath, sinks=[verifier])
+            is_valid = verifier.result()
+    """
+
+    def __init__(self, signature_file):
+        self.signature_file = signature_file
+        self.process = None
+        self.broken = False
+
+    def __enter__(self):
+        _check_gnupg_installed()
+        with open(GPG_PUBLIC_KEY_PATH) as fh:
+            keycontent = fh.read()
+        tmpdir = TemporaryDirectory()
+        try:
+            # raises OSError if gpg isn't installed
+            gpg = GPG(gnupghome=tmpdir.name)
+            gpg.import_keys(keycontent)
+            args = [gpg.gpgbinary, "--homedir", tmpdir.name, "--batch", "--no-tty"]
+            args += ["--status-fd", "1", "--verify", self.signature_file, "-"]
+            self.process = subprocess.Popen(
+                args,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+        except BaseException:
+            # `__exit__` isn't called if `__enter__` fails
+            _cleanup(tmpdir)
+            raise
+        self.tmpdir = tmpdir
+        return self
+
+    def update(self, chunk):
+        if self.broken:
+            return
+        try:
+            self.process.stdin.write(chunk)
+        except (BrokenPipeError, OSError):
+            # gpg exits early, e.g., for a broken signature file
+            self.broken = True
+
+    def result(self) -> bool:
+        """finish the verification and return if the signature is valid"""
+        try:
+            self.process.stdin.close()
+        except (BrokenPipeError, OSError):
+            self.broken = True
+        status = self.process.stdout.read().decode("utf-8", errors="replace")
+        returncode = self.process.wait()
+        return not self.broken and returncode == 0 and "[GNUPG:] VALIDSIG" in status
+
+    def __exit__(self, type, value, tb):
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        for fh in [self.process.stdin, self.process.stdout]:
+            if not fh.closed:
+                fh.close()
+        _cleanup(self.tmpdir)
@@ -0,0 +1,226 @@
+"""
+This module keeps a small on-disk record of the network performance of each mirror
+host so that mirrors don't need to be measured again in every jill run.
+"""
+
+from .defaults import MIRROR_CACHEFILE
+
+import httpx
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+
+# records older than this (in seconds) are measured again
+DEFAULT_MIRROR_CACHE_TTL = 24 * 60 * 60
+# weight of the newest observation in the running averages
+EWMA_ALPHA = 0.3
+# hosts are skipped after this many consecutive failures, for a cooldown period that
+# doubles with every further failure
+BREAKER_THRESHOLD = 3
+BREAKER_COOLDOWN = 15 * 60
+BREAKER_MAX_COOLDOWN = 24 * 60 * 60
+# timeouts (seconds) of hosts without RTT history
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 30
+# otherwise timeouts are `floor + multiplier * p95` of the recent RTT samples, hosts on
+# slow links can get more time than the defaults up to these limits
+RTT_HISTORY_SIZE = 20
+CONNECT_TIMEOUT_FLOOR = 0.25
+CONNECT_TIMEOUT_MULTIPLIER = 3
+MAX_CONNECT_TIMEOUT = 20
+READ_TIMEOUT_FLOOR = 3
+READ_TIMEOUT_MULTIPLIER = 10
+MAX_READ_TIMEOUT = 120
+# it usually takes longer for the nightlies bucket to send the first byte
+NIGHTLY_READ_TIMEOUT = 30
+
+
+def mirror_cache_ttl():
+    try:
+        return float(os.environ.get("JILL_MIRROR_CACHE_TTL", DEFAULT_MIRROR_CACHE_TTL))
+    except ValueError:
+        return DEFAULT_MIRROR_CACHE_TTL
+
+
+def _ewma(average, value):
+    return value if average is None else EWMA_ALPHA * value + (1 - EWMA_ALPHA) * average
+
+
+class MirrorCache:
+    """
+    latency (seconds), download throughput (bytes per second) and error rate of
+    mirror hosts. Throughput and error rate are running averages over all observed
+    requests.
+
+    A host that fails `BREAKER_THRESHOLD` times in a row is skipped until its cooldown
+    expires, after which it gets one more chance.
+
+    The cache is ignored, but still updated, after `refresh()` is called.
+    """
+
+    def __init__(self, path=MIRROR_CACHEFILE, ttl=None):
+        self.path = path
+        self.ttl = mirror_cache_ttl() if ttl is None else ttl
+        self.refreshed = False
+        self.records = self._load()
+        # downloads running in different threads record their outcomes here
+        self._lock = threading.RLock()
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                records = json.load(f).get("hosts", {})
+        except (OSError, ValueError, AttributeError):
+            return dict()
+        return records if isinstance(records, dict) else dict()
+
+    def _lookup(self, host, key):
+        if self.refreshed:
+            return None
+        record = self.records.get(host, {})
+        if key not in record or time.time() - record.get(f"{key}_time", 0) > self.ttl:
+            return None
+        return record[key]
+
+    def refresh(self):
+        self.refreshed = True
+
+    def latency(self, host):
+        return self._lookup(host, "latency")
+
+    def throughput(self, host):
+        return self._lookup(host, "throughput")
+
+    def error_rate(self, host):
+        return self.records.get(host, {}).get("error_rate", 0.0)
+
+    def score(self, host):
+        """the expected throughput of `host` discounted by its error rate"""
+        throughput = self.throughput(host)
+        if throughput is None:
+            return None
+        return throughput * (1 - self.error_rate(host))
+
+    def is_available(self, host):
+        """`False` if `host` failed repeatedly and its cooldown hasn't expired yet"""
+        if self.refreshed:
+            return True
+        return time.time() >= self.records.get(host, {}).get("open_until", 0)
+
+    def record_success(self, host, throughput=None):
+        with self._lock:
+            record = self.records.setdefault(host, dict())
+            record["error_rate"] = _ewma(record.get("error_rate", None), 0.0)
+            record["failures"] = 0
+            record.pop("open_until", None)
+            if throughput is not None:
+                self._update(host, "throughput", _ewma(self.throughput(host), throughput))
+            self.save()
+
+    def record_failure(self, host):
+        with self._lock:
+            record = self.records.setdefault(host, dict())
+            record["error_rate"] = _ewma(record.get("error_rate", None), 1.0)
+            record["failures"] = record.get("failures", 0) + 1
+            if record["failures"] >= BREAKER_THRESHOLD:
+                n = record["failures"] - BREAKER_THRESHOLD
+                cooldown = min(BREAKER_COOLDOWN * 2**n, BREAKER_MAX_COOLDOWN)
+                record["open_until"] = time.time() + cooldown
+            self.save()
+
+    def _update(self, host, key, value):
+        record = self.records.setdefault(host, dict())
+        record[key] = value
+        record[f"{key}_time"] = time.time()
+
+    def update_latencies(self, records):
+        with self._lock:
+            for host, latency in records.items():
+                self._update(host, "latency", latency)
+            self.save()
+
+    def rtts(self, host):
+        return self.records.get(host, {}).get("rtts", [])
+
+    def record_rtts(self, records):
+        """append the measured round-trip times `{host: seconds}` to the RTT history"""
+        with self._lock:
+            for host, rtt in records.items():
+                record = self.records.setdefault(host, dict())
+                record["rtts"] = (record.get("rtts", []) + [rtt])[-RTT_HISTORY_SIZE:]
+            self.save()
+
+    def update_throughput(self, host, throughput):
+        with self._lock:
+            self._update(host, "throughput", _ewma(self.throughput(host), throughput))
+            self.save()
+
+    def save(self):
+        # the cache is only an optimization, failing to write it isn't an error
+        outdir = os.path.dirname(self.path)
+        with self._lock:
+            try:
+                os.makedirs(outdir, exist_ok=True)
+                fd, tmppath = tempfile.mkstemp(dir=outdir, prefix=".mirrors.")
+                with os.fdopen(fd, "w") as f:
+                    json.dump({"hosts": self.records}, f, indent=2)
+                os.replace(tmppath, self.path)
+            except OSError:
+                pass
+
+
+def mirror_cache(cache=dict()) -> MirrorCache:
+    """return the process-wide mirror cache"""
+    if not cache:
+        cache["cache"] = MirrorCache()
+    return cache["cache"]
+
+
+class TimeoutPolicy:
+    """
+    per-host connect and read timeouts derived from the RTT history of the host. Hosts
+    that are known to be fast fail quickly, and hosts on slow links get more time.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def _p95(self, host):
+        rtts = sorted(self.cache.rtts(host))
+        if not rtts:
+            return None
+        return rtts[math.ceil(0.95 * len(rtts)) - 1]
+
+    def connect(self, host):
+        p95 = self._p95(host)
+        if p95 is None:
+            return DEFAULT_CONNECT_TIMEOUT
+        timeout = CONNECT_TIMEOUT_FLOOR + CONNECT_TIMEOUT_MULTIPLIER * p95
+        return min(timeout, MAX_CONNECT_TIMEOUT)
+
+    def read(self, host):
+        p95 = self._p95(host)
+        if p95 is None:
+            return DEFAULT_READ_TIMEOUT
+        timeout = READ_TIMEOUT_FLOOR + READ_TIMEOUT_MULTIPLIER * p95
+        return min(timeout, MAX_READ_TIMEOUT)
+
+    def timeout(self, host, min_read=0) -> httpx.Timeout:
+        """the timeout of `host`, the read timeout is at least `min_read` seconds"""
+        read = max(self.read(host), min_read)
+        return httpx.Timeout(connect=self.connect(host), read=read, write=read, pool=None)
+
+
+def timeout_policy(cache=dict()) -> TimeoutPolicy:
+    """return the timeout policy shared by all network requests"""
+    if not cache:
+        cache["policy"] = TimeoutPolicy(mirror_cache())
+    return cache["policy"]
+
+
+def refresh_mirrors():
+    """measure all mirrors again in this run instead of using the cached records"""
+    mirror_cache().refresh()
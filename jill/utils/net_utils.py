@@ -1,17 +1,150 @@
 from .sys_utils import show_verbose
+from .interactive_utils import color
+from .mirror_utils import mirror_cache, timeout_policy
 
 from urllib.parse import urlparse
 from ipaddress import ip_address
 
+import atexit
+import collections
+import errno
+import hashlib
 import httpx
+import itertools
+import json
+import os
+import queue
+import selectors
 import socket
+import threading
 import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 from typing import Optional
 
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+MIN_SEGMENT_SIZE = 1024 * 1024
+# how often the state of a resumable download is written to its sidecar
+CHECKPOINT_SIZE = 4 * 1024 * 1024
+# striped downloads hand out work to mirrors in blocks of this size
+STRIPE_BLOCK_SIZE = 4 * 1024 * 1024
+# racing downloads compare mirrors by the time to receive this many bytes
+RACE_SAMPLE_SIZE = 2 * 1024 * 1024
+# mirror benchmarks download this many bytes from each host
+BENCHMARK_SIZE = 8 * 1024 * 1024
+# a transfer is considered stalled if its throughput over this many seconds drops below
+# `JILL_MIN_THROUGHPUT` KB/s
+STALL_WINDOW = 10
 
-def query_external_ip(cache=[], timeout=5):
+
+class _HostLimitedStream(httpx.SyncByteStream):
+    def __init__(self, stream, semaphore):
+        self._stream = stream
+        self._semaphore = semaphore
+        self._released = False
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            if not self._released:
+                self._released = True
+                self._semaphore.release()
+
+
+class _HostLimitedTransport(httpx.BaseTransport):
+    """
+    limit the number of concurrent requests per host; a slot is held until the
+    response is closed
+    """
+
+    def __init__(self, transport, max_per_host):
+        self._transport = transport
+        self._max_per_host = max_per_host
+        self._semaphores = dict()  # type: ignore
+        self._lock = threading.Lock()
+
+    def handle_request(self, request):
+        timeout = request.extensions.get("timeout", {})
+        if not any(timeout.values()):
+            # requests without an explicit timeout follow the shared timeout policy
+            host = urlparse(str(request.url)).netloc
+            request.extensions["timeout"] = timeout_policy().timeout(host).as_dict()
+        origin = (request.url.scheme, request.url.host, request.url.port)
+        with self._lock:
+            if origin not in self._semaphores:
+                self._semaphores[origin] = threading.BoundedSemaphore(
+                    self._max_per_host
+                )
+            semaphore = self._semaphores[origin]
+        semaphore.acquire()
+        try:
+            response = self._transport.handle_request(request)
+        except BaseException:
+            semaphore.release()
+            raise
+        response.stream = _HostLimitedStream(response.stream, semaphore)
+        return response
+
+    def close(self):
+        self._transport.close()
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def http_client(*, bypass_ssl=False, cache=dict()) -> httpx.Client:
+    """
+    return the process-wide HTTP client. All network requests in jill share it so
+    that connections (and TLS sessions) to the same host are kept alive and reused.
+
+    The connection pool is configured by environment variables:
+
+    * `JILL_MAX_CONNECTIONS`: total number of connections (default: 32)
+    * `JILL_MAX_CONNECTIONS_PER_HOST`: concurrent requests per host (default: 8)
+    * `JILL_HTTP2`: set to `1` to enable HTTP/2, this requires `pip install httpx[http2]`
+
+    Requests without an explicit timeout use the per-host timeouts of `timeout_policy`.
+    """
+    verify = not bypass_ssl
+    if verify not in cache:
+        http2 = os.environ.get("JILL_HTTP2", "0").lower() in ["1", "true", "yes"]
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                warnings.warn(
+                    "JILL_HTTP2 requires the h2 package, fallback to HTTP/1.1",
+                    RuntimeWarning,
+                )
+                http2 = False
+        max_connections = _env_int("JILL_MAX_CONNECTIONS", 32)
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=30,
+        )
+        transport = _HostLimitedTransport(
+            httpx.HTTPTransport(verify=verify, http2=http2, limits=limits),
+            _env_int("JILL_MAX_CONNECTIONS_PER_HOST", 8),
+        )
+        cache[verify] = httpx.Client(
+            transport=transport, follow_redirects=True, timeout=None
+        )
+        atexit.register(cache[verify].close)
+    return cache[verify]
+
+
+def query_external_ip(cache=[]):
     if cache:
         assert len(cache) == 1
         return cache[0]
@@ -19,13 +152,12 @@ def query_external_ip(cache=[], timeout=5):
     # try to use external ip address, if it fails, use the local ip address
     # failures could be due to several reasons, e.g., enterprise gateway
     try:
-        with httpx.Client(timeout=timeout, follow_redirects=True) as client:
-            response = client.get("https://api.ipify.org")
-            response.raise_for_status()
-            ip = response.text
-            # store external ip because the query takes time
-            cache.append(ip)
-            return ip
+        response = http_client().get("https://api.ipify.org")
+        response.raise_for_status()
+        ip = response.text
+        # store external ip because the query takes time
+        cache.append(ip)
+        return ip
     except httpx.HTTPError:
         return socket.gethostbyname(socket.gethostname())
 
@@ -50,93 +182,1225 @@ def query_ip(url: Optional[str] = None):
     return ip
 
 
+class _NetworkMemo:
+    """
+    what this process has already learned about the network. Every resolver consults
+    it so that each observation is made at most once per run.
+    """
+
+    def __init__(self):
+        self.addresses = dict()  # type: ignore # (host, port) -> getaddrinfo answers
+        self.connect_times = dict()  # type: ignore # (host, port) -> seconds
+        self.responses = dict()  # type: ignore # url -> True if it serves the file
+        self.hosts = dict()  # type: ignore # netloc -> True if it's reachable
+
+    def observe(self, url, ok, reachable=True):
+        self.responses[url] = ok
+        self.hosts[urlparse(url).netloc] = reachable
+
+
+def network_memo(cache=dict()) -> _NetworkMemo:
+    """return the network observations of this process"""
+    if not cache:
+        cache["memo"] = _NetworkMemo()
+    return cache["memo"]
+
+
+def query_addresses(host, port):
+    """
+    resolve `host` with `getaddrinfo` and return a list of `(family, sockaddr)`. IPv6
+    and IPv4 addresses are interleaved as suggested by happy eyeballs (RFC 8305).
+    """
+    memo = network_memo()
+    if (host, port) not in memo.addresses:
+        memo.addresses[(host, port)] = _query_addresses(host, port)
+    return memo.addresses[(host, port)]
+
+
+def _query_addresses(host, port):
+    try:
+        # skip address families that aren't configured on this machine
+        infos = socket.getaddrinfo(
+            host, port, type=socket.SOCK_STREAM, flags=socket.AI_ADDRCONFIG
+        )
+    except (socket.gaierror, UnicodeError, OSError):
+        return []
+    families = dict()  # type: ignore
+    for family, _, _, _, sockaddr in infos:
+        addresses = families.setdefault(family, [])
+        if (family, sockaddr) not in addresses:
+            addresses.append((family, sockaddr))
+    interleaved = itertools.zip_longest(*families.values())
+    return [x for x in itertools.chain.from_iterable(interleaved) if x is not None]
+
+
+# happy eyeballs: wait this long before trying the next address of the same host
+CONNECTION_ATTEMPT_DELAY = 0.25
+_CONNECT_IN_PROGRESS = {errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY, 10035}
+
+
+def response_times(endpoints, timeout=2):
+    """
+    return the TCP connect time for each `(host, port)` in `endpoints`. All endpoints
+    are probed at the same time and the addresses of the same host are raced happy
+    eyeballs style, i.e., the next address is tried if the previous one doesn't
+    connect within `CONNECTION_ATTEMPT_DELAY` seconds.
+
+    `timeout` is either the timeout of all endpoints or a dict that maps each endpoint
+    to its own timeout. The latency is `timeout` if the host doesn't response in time,
+    and `10 * timeout` if it's unreachable, e.g., it can't be resolved or it refuses
+    the connection.
+    """
+    endpoints = list(dict.fromkeys(endpoints))
+    timeouts = timeout if isinstance(timeout, dict) else {x: timeout for x in endpoints}
+    # endpoints that are already measured in this run are not probed again
+    memo = network_memo()
+    measured = {x: memo.connect_times[x] for x in endpoints if x in memo.connect_times}
+    endpoints = [x for x in endpoints if x not in measured]
+    records = {x: 10 * timeouts[x] for x in endpoints}
+    if not endpoints:
+        return measured
+
+    with ThreadPoolExecutor(max_workers=min(len(endpoints), 16)) as executor:
+        resolved = executor.map(lambda x: query_addresses(*x), endpoints)
+        pending = {x: y for x, y in zip(endpoints, resolved) if y}
+
+    selector = selectors.DefaultSelector()
+    sockets = {x: [] for x in pending}  # type: ignore
+    next_attempt = {x: time.perf_counter() for x in pending}
+
+    def _close(endpoint):
+        for sock in sockets.pop(endpoint, []):
+            selector.unregister(sock)
+            sock.close()
+        pending.pop(endpoint, None)
+        next_attempt.pop(endpoint, None)
+
+    def _connect(endpoint, now):
+        family, sockaddr = pending[endpoint].pop(0)
+        try:
+            sock = socket.socket(family, socket.SOCK_STREAM)
+        except OSError:
+            # e.g., IPv6 is disabled in the kernel
+            next_attempt[endpoint] = now
+            return
+        sock.setblocking(False)
+        err = sock.connect_ex(sockaddr)
+        if err == 0:
+            sock.close()
+            records[endpoint] = time.perf_counter() - now
+            _close(endpoint)
+        elif err in _CONNECT_IN_PROGRESS:
+            selector.register(sock, selectors.EVENT_WRITE, (endpoint, now))
+            sockets[endpoint].append(sock)
+            next_attempt[endpoint] = now + CONNECTION_ATTEMPT_DELAY
+        else:
+            sock.close()
+            next_attempt[endpoint] = now  # try the next address immediately
+
+    now = time.perf_counter()
+    deadlines = {x: now + timeouts[x] for x in pending}
+    try:
+        while sockets or pending:
+            now = time.perf_counter()
+            for endpoint in [x for x in pending if deadlines[x] <= now]:
+                records[endpoint] = timeouts[endpoint]
+                _close(endpoint)
+            for endpoint, when in list(next_attempt.items()):
+                if when <= now and pending.get(endpoint):
+                    _connect(endpoint, now)
+            for endpoint in [x for x in pending if not pending[x] and not sockets[x]]:
+                _close(endpoint)  # all addresses failed
+            if not sockets and not pending:
+                break
+
+            waits = [t for x, t in next_attempt.items() if pending.get(x)]
+            waits += [deadlines[x] for x in pending]
+            wait = min(waits) - time.perf_counter()
+            if not selector.get_map():
+                time.sleep(max(wait, 0))
+                continue
+            for key, _ in selector.select(max(wait, 0)):
+                endpoint, started = key.data
+                if endpoint not in sockets:
+                    continue
+                sock = key.fileobj
+                err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if err == 0:
+                    records[endpoint] = time.perf_counter() - started
+                    _close(endpoint)
+                else:
+                    selector.unregister(sock)
+                    sockets[endpoint].remove(sock)
+                    sock.close()
+                    next_attempt[endpoint] = time.perf_counter()
+    finally:
+        for endpoint in list(sockets):
+            _close(endpoint)
+        selector.close()
+    records = {x: min(t, 10 * timeouts[x]) for x, t in records.items()}
+    memo.connect_times.update(records)
+    return {**measured, **records}
+
+
 def port_response_time(host, port, timeout=2):
     """
     return the network latency to host:port, if the latency exceeds
     timeout then return timeout.
 
-    If host is '0.0.0.0' then directly return a number larger than timeout.
+    If host is '0.0.0.0' or unreachable then directly return a number larger than timeout.
     """
     if host == "0.0.0.0":
         return 10 * timeout
+    return response_times([(host, port)], timeout)[(host, port)]
 
-    start = time.time()
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.settimeout(timeout)
-    sock.connect_ex((host, port))  # We only care if it connects, not the result
-    roundtrip = time.time() - start
-    return min(roundtrip, timeout)
 
+def measure_throughput(url, size=BENCHMARK_SIZE, *, duration=10):
+    """
+    download at most the first `size` bytes of `url` within `duration` seconds, and
+    return a dict with the time to first byte `ttfb` (seconds), the `throughput`
+    (bytes per second) and the `received` bytes. Return `None` if it fails.
+    """
+    headers = {"Range": f"bytes=0-{size - 1}"}
+    start = time.perf_counter()
+    deadline = start + duration
+    ttfb, received = None, 0
+    try:
+        with http_client().stream("GET", url, headers=headers) as r:
+            r.raise_for_status()
+            for chunk in r.iter_bytes(DOWNLOAD_CHUNK_SIZE):
+                if ttfb is None:
+                    ttfb = time.perf_counter() - start
+                received += len(chunk)
+                # servers that ignore the range request send the whole file
+                if received >= size or time.perf_counter() > deadline:
+                    break
+    except httpx.HTTPError as e:
+        if show_verbose():
+            print(f"failed to benchmark {url}: {e}")
+        return None
+    if ttfb is None:
+        return None
+    elapsed = time.perf_counter() - start - ttfb
+    # a single chunk arrives at once, count the whole request time instead
+    elapsed = elapsed if elapsed > 0 else ttfb
+    return {"ttfb": ttfb, "throughput": received / elapsed, "received": received}
 
-def first_response(url_lists, timeout):
+
+def first_response(url_lists, timeout=None, min_read_timeout=0, *, bypass_ssl=False):
     """
-    send GET request to each url, return the first url that responses and skip drop all other urls.
-    The connection is closed after receiving the first few bytes to optimize performance.
+    probe all urls at the same time and return the first url that responses; the
+    other probes are abandoned. Each probe only asks for the first byte of the
+    file (`Range: bytes=0-0`) so that no body is transferred. Return `None` if no url
+    responses within `timeout` seconds, which defaults to the per-host timeouts of
+    `timeout_policy` with a read timeout of at least `min_read_timeout` seconds.
+
+    The probes are sent by the shared `http_client` so that the connections they open
+    are reused by the download that follows.
+
+    Urls that are already probed in this run are not probed again. Hosts that failed
+    repeatedly or are unreachable in this run are skipped unless all hosts are.
     """
+    cache, memo = mirror_cache(), network_memo()
+    url_lists = [url for url in url_lists if url]
+    known = [url for url in url_lists if memo.responses.get(url)]
+    if known:
+        return known[0]
+    url_lists = [url for url in url_lists if url not in memo.responses]
 
-    async def _query(url):
-        if show_verbose():
-            print(f"send GET request to {url}")
-        with httpx.Client(timeout=timeout, follow_redirects=True) as client:
-            with client.stream("GET", url) as r:
-                for chunk in r.iter_bytes():
-                    if chunk:
-                        return r
+    def _available(url):
+        host = urlparse(url).netloc
+        return cache.is_available(host) and memo.hosts.get(host, True)
+
+    available = [url for url in url_lists if _available(url)]
+    url_lists = available if available else url_lists
+    if not url_lists:
         return None
+    if show_verbose() and timeout is not None:
+        print(f"probe request timeout: {timeout}")
 
-    if show_verbose():
-        print(f"GET request timeout: {timeout}")
+    def _timeout(url):
+        if timeout is not None:
+            return httpx.Timeout(timeout)
+        host = urlparse(url).netloc
+        return timeout_policy().timeout(host, min_read=min_read_timeout)
 
-    # Use asyncio for concurrent requests
-    import asyncio
+    client = http_client(bypass_ssl=bypass_ssl)
 
-    async def _async_query(url):
+    def _query(url):
+        if show_verbose():
+            print(f"send probe request to {url}")
         try:
-            response = await _query(url)
-            if show_verbose():
-                print(f"response {url} with status code {response.status_code}")
-            if response.status_code == 200:
-                return url
+            headers = {"Range": "bytes=0-0"}
+            request = client.build_request(
+                "GET", url, headers=headers, timeout=_timeout(url)
+            )
+            response = client.send(request, stream=True)
+            # servers that don't support range requests send the whole file
+            response.close()
         except httpx.HTTPError as e:
             if show_verbose():
                 print(f"HTTPError: {url} {e}")
-            pass
+            memo.observe(url, False, reachable=not isinstance(e, httpx.TransportError))
+            if _is_host_failure(e):
+                cache.record_failure(urlparse(url).netloc)
+            return None
+        if show_verbose():
+            print(f"response {url} with status code {response.status_code}")
+        ok = response.status_code in [200, 206]
+        memo.observe(url, ok)
+        if response.status_code >= 500:
+            cache.record_failure(urlparse(url).netloc)
+        elif ok:
+            cache.record_success(urlparse(url).netloc)
+            return url
         return None
 
-    async def _main():
-        tasks = []
-        for url in url_lists:
-            task = asyncio.create_task(_async_query(url))
-            tasks.append(task)
+    def _worker(url):
+        try:
+            results.put(_query(url))
+        except Exception:
+            results.put(None)
+            raise
+
+    # return as soon as a probe succeeds: the other probes run in daemon threads so
+    # that they neither delay the download nor the exit of jill while they wait for
+    # their timeouts
+    results = queue.Queue()
+    for url in url_lists:
+        threading.Thread(target=_worker, args=(url,), daemon=True).start()
+    for _ in url_lists:
+        url = results.get()
+        if url:
+            return url
+    return None
+
+
+class _RangeIgnored(httpx.HTTPError):
+    """the server answered a range request with the full content"""
+
+
+class _Stalled(httpx.TransportError):
+    """the transfer is too slow to be worth continuing"""
+
+
+class _StallMonitor:
+    """raise `_Stalled` if less than `min_rate` bytes per second arrive in `window` seconds"""
+
+    def __init__(self, min_rate, window=STALL_WINDOW):
+        self.min_rate = min_rate
+        self.window = window
+        self.received = 0
+        self._samples = collections.deque([(time.monotonic(), 0)])
+
+    def update(self, nbytes):
+        now = time.monotonic()
+        self.received += nbytes
+        self._samples.append((now, self.received))
+        # keep the newest sample that is at least `window` seconds old as the start
+        while len(self._samples) > 2 and now - self._samples[1][0] >= self.window:
+            self._samples.popleft()
+        started, received = self._samples[0]
+        if now - started >= self.window:
+            rate = (self.received - received) / (now - started)
+            if rate < self.min_rate:
+                raise _Stalled(f"stalled at {rate / 1024:.1f} KB/s")
+
+
+def _stall_monitor(connections=1):
+    # the throughput floor applies to the whole transfer, each of its `connections`
+    # only carries a part of the link
+    min_rate = _env_int("JILL_MIN_THROUGHPUT", 16) * 1024 / max(connections, 1)
+    return _StallMonitor(min_rate) if min_rate > 0 else None
+
+
+class DownloadCancelled(Exception):
+    """the download is cancelled by its `cancel` event"""
+
+
+class DownloadCorrupted(Exception):
+    """the downloaded content doesn't match its expected size or checksum"""
+
+
+class _Abort:
+    """the abort flag of one run of workers, it also follows an external `cancel` event"""
+
+    def __init__(self, cancel=None):
+        self._event = threading.Event()
+        self._cancel = cancel
+
+    def set(self):
+        self._event.set()
+
+    def is_set(self):
+        return self._event.is_set() or bool(self._cancel and self._cancel.is_set())
+
+
+class _HostStats:
+    """
+    the hosts that served or failed one download, they're recorded to the mirror
+    cache once the download finishes so that each host counts at most once
+    """
+
+    def __init__(self):
+        self.failures = set()
+        # url -> [bytes, first start, last end] of the data it delivered
+        self.deliveries = dict()
+        self._lock = threading.Lock()
+
+    def fail(self, url):
+        with self._lock:
+            self.failures.add(urlparse(str(url)).netloc)
+
+    def deliver(self, url, nbytes, started, finished):
+        if nbytes <= 0:
+            return
+        with self._lock:
+            record = self.deliveries.setdefault(str(url), [0, started, finished])
+            record[0] += nbytes
+            record[1] = min(record[1], started)
+            record[2] = max(record[2], finished)
+
+    def record(self, succeeded=True, striped=False):
+        cache = mirror_cache()
+        for host in self.failures:
+            cache.record_failure(host)
+        if not succeeded:
+            return
+        for url, (nbytes, started, finished) in self.deliveries.items():
+            host = urlparse(url).netloc
+            if host in self.failures:
+                # a stalled host isn't healthy even if it delivered some bytes
+                continue
+            # small files say more about the latency than the bandwidth of a mirror,
+            # and striped downloads don't belong to a single mirror
+            elapsed = finished - started
+            if striped or nbytes < MIN_SEGMENT_SIZE or elapsed <= 0:
+                cache.record_success(host)
+            else:
+                cache.record_success(host, nbytes / elapsed)
+
+
+class _Transfer:
+    """
+    Book-keeping of a download: validators of the remote file and how many bytes of
+    each byte range are already written to `path`.
+
+    The data is written to the hidden file `.<outname>.part` in the destination
+    folder and moved into place with an atomic rename once it's finished. For
+    resumable downloads, the data is written to `<outname>.part` instead and the state
+    is persisted to the JSON sidecar `<outname>.part.json` so that the next run can
+    continue from where the previous one stopped.
+
+    `sinks` are objects with an `update(chunk)` method, e.g., a hashlib object. They
+    receive the file content in order while it is written: bytes that arrive out of
+    order (e.g., from later segments) are read back from disk once all bytes before
+    them are written.
+    """
+
+    def __init__(
+        self,
+        url,
+        outpath,
+        *,
+        resume=False,
+        expected_size=None,
+        expected_sha256=None,
+        sinks=(),
+        stats=None,
+    ):
+        self.url = url
+        # where the data is fetched from, it's a mirror of `url` if the mirror wins
+        # the race
+        self.source = url
+        self.outpath = outpath
+        if resume:
+            self.path = outpath + ".part"
+        else:
+            outdir, outname = os.path.split(outpath)
+            self.path = os.path.join(outdir, f".{outname}.part")
+        self.sidecar = self.path + ".json" if resume else None
+        self.etag = None
+        self.last_modified = None
+        # other urls that serve the very same file
+        self.mirrors = []
+        # fallback url -> whether it serves the very same file
+        self.checked = dict()
+        # each item is [start, end, received], `end` is inclusive and None if unknown
+        self.ranges = [[0, None, 0]]
+        self.expected_size = expected_size
+        self.expected_sha256 = expected_sha256.lower() if expected_sha256 else None
+        self.digest = hashlib.sha256() if expected_sha256 else None
+        self.sinks = list(sinks) + ([self.digest] if self.digest else [])
+        self.fed = 0  # bytes of the file that are already fed into sinks
+        self.stats = stats if stats is not None else _HostStats()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, url, outpath, **kwargs):
+        """return the previously saved state of `outpath`, or None if it can't be resumed"""
+        transfer = cls(url, outpath, resume=True, **kwargs)
+        if not (os.path.isfile(transfer.path) and os.path.isfile(transfer.sidecar)):
+            return None
+        try:
+            with open(transfer.sidecar, "r") as f:
+                state = json.load(f)
+            if state["url"] != url:
+                return None
+            transfer.source = state.get("source", url)
+            transfer.etag = state["etag"]
+            transfer.last_modified = state["last_modified"]
+            transfer.ranges = [list(x) for x in state["ranges"]]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        if not transfer.validator:
+            # without a validator we can't tell if the remote file has changed
+            return None
+        return transfer
+
+    @property
+    def validator(self):
+        # weak ETags can't be used in `If-Range`
+        if self.etag and not self.etag.startswith("W/"):
+            return self.etag
+        return self.last_modified
+
+    @property
+    def size(self):
+        end = self.ranges[-1][1]
+        return None if end is None else end + 1
+
+    @property
+    def received(self):
+        return sum(x[2] for x in self.ranges)
+
+    def update_validators(self, response):
+        self.etag = response.headers.get("ETag", None)
+        self.last_modified = response.headers.get("Last-Modified", None)
+
+    def split(self, size, segments):
+        """split `[0, size)` into at most `segments` byte ranges"""
+        step = -(-size // segments)
+        self.ranges = [
+            [start, min(start + step, size) - 1, 0] for start in range(0, size, step)
+        ]
+
+    def is_done(self, index):
+        start, end, received = self.ranges[index]
+        return end is not None and received == end - start + 1
+
+    def advance(self, index, nbytes):
+        with self._lock:
+            self.ranges[index][2] += nbytes
+
+    def check_size(self, size, url):
+        """fail early if the server announces a different size than expected"""
+        if self.expected_size is not None and size != self.expected_size:
+            raise DownloadCorrupted(
+                f"{url} has {size} bytes, expected {self.expected_size} bytes"
+            )
+
+    def _on_disk(self, start, stop):
+        """check if all bytes in `[start, stop)` are written"""
+        for first, end, received in self.ranges:
+            last = stop - 1 if end is None else min(end, stop - 1)
+            if first <= last and last >= start and first + received <= last:
+                return False
+        return True
+
+    def _feed_from_disk(self, stop=None):
+        with open(self.path, "rb") as f:
+            f.seek(self.fed)
+            while stop is None or self.fed < stop:
+                nbytes = DOWNLOAD_CHUNK_SIZE * 16
+                if stop is not None:
+                    nbytes = min(nbytes, stop - self.fed)
+                block = f.read(nbytes)
+                if not block:
+                    break
+                for sink in self.sinks:
+                    sink.update(block)
+                self.fed += len(block)
+
+    def feed(self, offset, chunk):
+        """feed `chunk` written at `offset` to sinks if all bytes before it are fed"""
+        if not self.sinks:
+            return
+        with self._lock:
+            if offset > self.fed and self._on_disk(self.fed, offset):
+                # e.g., the data of a previous run or of a finished segment
+                self._feed_from_disk(offset)
+            if offset == self.fed:
+                for sink in self.sinks:
+                    sink.update(chunk)
+                self.fed += len(chunk)
+
+    def verify(self):
+        """check the downloaded file against the expected size and sha256 checksum"""
+        self.check_size(self.received, self.url)
+        if self.sinks:
+            with self._lock:
+                self._feed_from_disk()
+        if self.digest is None:
+            return
+        checksum = self.digest.hexdigest()
+        if checksum != self.expected_sha256:
+            raise DownloadCorrupted(
+                f"sha256 checksum mismatch: got {checksum}, expected {self.expected_sha256}"
+            )
+
+    def discard(self):
+        """remove the partial download so that the next run starts from scratch"""
+        for path in [self.path, self.sidecar]:
+            if path and os.path.exists(path):
+                os.remove(path)
+
+    def allocate(self, preallocate=True):
+        """
+        create an empty output file. If the size is known and `preallocate=True`, disk
+        space is reserved upfront so that running out of space fails immediately.
+        """
+        size = self.size if self.size is not None else self.expected_size
+        with open(self.path, "wb") as f:
+            if size and preallocate and hasattr(os, "posix_fallocate"):
+                try:
+                    os.posix_fallocate(f.fileno(), 0, size)
+                except OSError as e:
+                    if e.errno == errno.ENOSPC:
+                        raise
+                    # the filesystem doesn't support it, e.g., some network filesystems
+            if self.size is not None:
+                # segments are written at their offsets
+                f.truncate(self.size)
+
+    def save(self):
+        if self.sidecar is None:
+            return
+        with self._lock:
+            state = {
+                "url": self.url,
+                "source": self.source,
+                "etag": self.etag,
+                "last_modified": self.last_modified,
+                "ranges": self.ranges,
+            }
+            tmp_sidecar = self.sidecar + ".tmp"
+            with open(tmp_sidecar, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp_sidecar, self.sidecar)
+
+    def finish(self):
+        os.replace(self.path, self.outpath)
+        if self.sidecar is not None:
+            os.remove(self.sidecar)
+
+
+def _write_chunks(transfer, index, chunks, abort, monitor=None):
+    """write `chunks` to the byte range `transfer.ranges[index]` from where it stopped"""
+    start, _, received = transfer.ranges[index]
+    # each worker owns one file handle and at most one chunk, so the memory
+    # usage is bounded by `segments * DOWNLOAD_CHUNK_SIZE`. The file is unbuffered so
+    # that the written bytes are immediately visible to `_Transfer.feed`.
+    with open(transfer.path, "r+b", buffering=0) as f:
+        f.seek(start + received)
+        unsaved = 0
+        for chunk in chunks:
+            if abort.is_set():
+                return
+            offset = f.tell()
+            if transfer.expected_size is not None:
+                if offset + len(chunk) > transfer.expected_size:
+                    raise DownloadCorrupted(
+                        f"received more than the expected {transfer.expected_size} bytes"
+                    )
+            f.write(chunk)
+            transfer.feed(offset, chunk)
+            transfer.advance(index, len(chunk))
+            unsaved += len(chunk)
+            if unsaved >= CHECKPOINT_SIZE:
+                transfer.save()
+                unsaved = 0
+            if monitor is not None:
+                monitor.update(len(chunk))
+
+
+def _is_host_failure(e):
+    """`True` if `e` tells that the mirror is broken rather than the request"""
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code >= 500
+    return isinstance(e, (httpx.TransportError, DownloadCorrupted))
+
+
+def is_modified(url, validators, *, bypass_ssl=False):
+    """
+    Check if `url` has changed since it was downloaded, `validators` are the ones
+    collected by `download(..., validators=...)`. A conditional HEAD request with
+    `If-None-Match`/`If-Modified-Since` is sent; only a 304 answer means "not modified".
+    """
+    if not validators or validators.get("url", None) != str(url):
+        # validators are only meaningful to the server that issued them
+        return True
+
+    headers = dict()
+    if validators.get("etag", None):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified", None):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    if not headers:
+        return True
+    try:
+        client = http_client(bypass_ssl=bypass_ssl)
+        response = client.head(url, headers=headers)
+    except httpx.HTTPError as e:
+        if show_verbose():
+            print(f"failed to check if {url} is modified: {e}")
+        return True
+    return response.status_code != 304
+
+
+def _check_content_range(transfer, response, url):
+    """check that a mirror serves a file of the same size"""
+    total = response.headers.get("Content-Range", "").rpartition("/")[2]
+    if not total.isdigit():
+        return
+    size = transfer.size if transfer.size is not None else transfer.expected_size
+    if size is not None and int(total) != size:
+        raise _RangeIgnored(f"{url} has {total} bytes, expected {size} bytes")
+
+
+def _fetch_range(client, transfer, index, abort, url=None, monitor=None):
+    url = url if url else transfer.source
+    before, started = transfer.ranges[index][2], time.perf_counter()
+    try:
+        _fetch_range_from(client, transfer, index, abort, url, monitor)
+    finally:
+        nbytes = transfer.ranges[index][2] - before
+        transfer.stats.deliver(url, nbytes, started, time.perf_counter())
+
+
+def _fetch_range_from(client, transfer, index, abort, url, monitor):
+    start, end, received = transfer.ranges[index]
+    offset = start + received
+    headers = dict()
+    ranged = end is not None or offset > 0
+    if ranged:
+        headers["Range"] = f"bytes={offset}-{'' if end is None else end}"
+        # validators are only meaningful to the server that issued them
+        if transfer.validator and url == transfer.source:
+            headers["If-Range"] = transfer.validator
+
+    with client.stream("GET", url, headers=headers) as response:
+        if response.status_code == 416 and end is None:
+            # the previous run stopped right after receiving the last byte
+            return
+        response.raise_for_status()
+        if ranged and response.status_code != 206:
+            raise _RangeIgnored(f"{url} ignores range request {headers}")
+        if ranged and url != transfer.source:
+            _check_content_range(transfer, response, url)
+        if not ranged:
+            transfer.update_validators(response)
+            if "Content-Length" in response.headers:
+                transfer.check_size(int(response.headers["Content-Length"]), url)
+        chunks = response.iter_bytes(DOWNLOAD_CHUNK_SIZE)
+        _write_chunks(transfer, index, chunks, abort, monitor)
+
+    if end is not None and not abort.is_set() and not transfer.is_done(index):
+        raise httpx.ReadError(
+            f"incomplete range bytes={start}-{end}: received {transfer.ranges[index][2]} bytes"
+        )
+
+
+def _failover(transfer, index, url, next_url, e):
+    offset = sum(transfer.ranges[index][0::2])
+    msg = f"{urlparse(url).netloc} {e} at byte {offset}, "
+    if next_url == url:
+        msg += "no other mirror serves the file, keep downloading from it"
+    else:
+        msg += f"switch to {urlparse(next_url).netloc}"
+    print(f"{color.YELLOW}{msg}{color.END}")
+
+
+def _serves_same_file(client, transfer, url):
+    """check with a HEAD request that `url` serves the file of `transfer` with ranges"""
+    if url not in transfer.checked:
+        try:
+            size, accepts_ranges, _ = _probe(client, url)
+        except httpx.HTTPError as e:
+            if _is_host_failure(e):
+                transfer.stats.fail(url)
+            if show_verbose():
+                print(f"skip fallback {url}: {e}")
+            size, accepts_ranges = None, False
+        expected = transfer.size
+        if expected is None:
+            expected = transfer.expected_size
+        transfer.checked[url] = accepts_ranges and expected in [None, size]
+    return transfer.checked[url]
+
+
+def _fetch_with_failover(
+    client, transfer, index, abort, fallbacks=(), url=None, error=None, connections=1
+):
+    """
+    fetch `transfer.ranges[index]` from `url` (default: `transfer.source`). If it stalls
+    or fails, continue from the current offset with the next url of `fallbacks` that
+    serves the same file. If there's no such url, a stalled transfer continues from
+    the slow host it started with.
+
+    `error` is the error that `url` already failed with, and `connections` is the
+    number of byte ranges of the transfer that are fetched at the same time.
+    """
+    url = url if url else transfer.source
+    candidates = [x for x in fallbacks if x != url]
+    stalled = []
+    while True:
+        if error is None:
+            try:
+                monitor = _stall_monitor(connections) if candidates else None
+                _fetch_range(client, transfer, index, abort, url=url, monitor=monitor)
+                return
+            except httpx.HTTPError as e:
+                if abort.is_set():
+                    raise
+                # `download` handles other errors of the main url, e.g., servers that
+                # don't support range requests
+                if url == transfer.source and not _is_host_failure(e):
+                    raise
+                error = e
+
+        if _is_host_failure(error):
+            transfer.stats.fail(url)
+        if isinstance(error, _Stalled):
+            stalled.append(url)
+        next_url = None
+        while candidates and next_url is None:
+            candidate = candidates.pop(0)
+            if _serves_same_file(client, transfer, candidate):
+                next_url = candidate
+        if next_url is None and stalled:
+            # a slow host is still better than none
+            next_url = stalled.pop(0)
+        if next_url is None:
+            raise error
+        _failover(transfer, index, url, next_url, error)
+        url, error = next_url, None
+
+
+def _run_striped(client, transfer, connections, cancel=None):
+    """
+    Fetch the pending byte ranges of `transfer` from all its mirrors at once.
+
+    Each mirror runs `connections` workers that keep pulling the next pending range
+    from a shared queue, so faster mirrors naturally take over more of the work. A
+    mirror that fails hands its range back to the queue and leaves the pool.
+    """
+    pending = queue.Queue()
+    for i in range(len(transfer.ranges)):
+        if not transfer.is_done(i):
+            pending.put(i)
+    urls = [transfer.source] + transfer.mirrors
+    abort = _Abort(cancel)
+
+    def _worker(url):
+        """return the number of bytes received from `url`"""
+        received = 0
+        while not abort.is_set():
+            try:
+                index = pending.get_nowait()
+            except queue.Empty:
+                break
+            before = transfer.ranges[index][2]
+            try:
+                _fetch_range(client, transfer, index, abort, url=url)
+            except httpx.HTTPError as e:
+                pending.put(index)
+                msg = f"drop mirror {urlparse(url).netloc}: {e}"
+                print(f"{color.YELLOW}{msg}{color.END}")
+                break
+            finally:
+                received += transfer.ranges[index][2] - before
+        return received
+
+    received = {url: 0 for url in urls}
+    with ThreadPoolExecutor(max_workers=len(urls) * connections) as executor:
+        futures = {
+            executor.submit(_worker, url): url
+            for url in urls
+            for _ in range(connections)
+        }
+        try:
+            for future in as_completed(futures):
+                received[futures[future]] += future.result()
+        except BaseException:
+            abort.set()
+            raise
+        finally:
+            transfer.save()
+
+    if show_verbose():
+        for url, nbytes in received.items():
+            print(f"received {nbytes} bytes from {urlparse(url).netloc}")
+    unfinished = [i for i in range(len(transfer.ranges)) if not transfer.is_done(i)]
+    if unfinished:
+        raise httpx.HTTPError(
+            f"all mirrors failed, {len(unfinished)} byte ranges are not downloaded"
+        )
+
+
+class _Racer:
+    def __init__(self, url, response, chunks, head, rate):
+        self.url = url
+        self.response = response
+        self.chunks = chunks  # the rest of the response body
+        self.head = head  # the first bytes of the response body
+        self.rate = rate  # bytes per second
+
+
+def _race_one(client, url, abort):
+    start = time.time()
+    response = client.send(client.build_request("GET", url), stream=True)
+    try:
+        response.raise_for_status()
+        chunks = response.iter_bytes(DOWNLOAD_CHUNK_SIZE)
+        head = bytearray()
+        for chunk in chunks:
+            if abort.is_set():
+                response.close()
+                return None
+            head += chunk
+            if len(head) >= RACE_SAMPLE_SIZE:
+                break
+        rate = len(head) / max(time.time() - start, 1e-6)
+        return _Racer(url, response, chunks, bytes(head), rate)
+    except BaseException:
+        response.close()
+        raise
+
+
+def _race(client, urls, cancel=None):
+    """
+    start downloading from all `urls` at once and return the `_Racer` that first
+    receives `RACE_SAMPLE_SIZE` bytes; all other transfers are cancelled.
+    """
+    abort = _Abort(cancel)
+    winner = None
+    # don't wait for the losers: they might still be waiting for a connection slot
+    # that the winner holds until the whole download finishes
+    executor = ThreadPoolExecutor(max_workers=len(urls))
+    futures = {executor.submit(_race_one, client, url, abort): url for url in urls}
+    try:
+        for future in as_completed(futures):
             try:
-                result = await task
-                if result:
-                    # Cancel all remaining tasks when we get a successful response
-                    for t in tasks:
-                        if not t.done():
-                            t.cancel()
-                    return result
-            except asyncio.CancelledError:
+                winner = future.result()
+            except httpx.HTTPError as e:
+                if show_verbose():
+                    print(f"drop candidate {futures[future]}: {e}")
                 continue
-        return None
+            if winner is not None:
+                break
+    finally:
+        abort.set()
+        executor.shutdown(wait=False)
+
+    def _close_loser(future):
+        if future.exception() is None and future.result() not in [None, winner]:
+            future.result().response.close()
+
+    for future in futures:
+        future.add_done_callback(_close_loser)
+    if winner is None:
+        raise httpx.HTTPError(f"failed to download from any of {urls}")
+    if show_verbose():
+        print(f"racing candidates: {', '.join(urlparse(x).netloc for x in urls)}")
+    msg = f"pick {urlparse(winner.url).netloc} ({winner.rate / 1024 / 1024:.2f} MB/s)"
+    print(f"{color.GREEN}{msg}{color.END}")
+    return winner
+
+
+def _run_race(
+    client, urls, outpath, *, resume, cancel=None, preallocate=True, **kwargs
+):
+    started = time.perf_counter()
+    winner = _race(client, urls, cancel)
+    # the resumable state belongs to the requested url wherever the data comes from
+    transfer = _Transfer(urls[0], outpath, resume=resume, **kwargs)
+    transfer.source = winner.url
+    transfer.update_validators(winner.response)
+    if "Content-Length" in winner.response.headers:
+        transfer.check_size(int(winner.response.headers["Content-Length"]), winner.url)
+    transfer.allocate(preallocate)
+    # the other candidates take over if the winner stalls later
+    fallbacks = [x for x in urls if x != winner.url]
+    abort = _Abort(cancel)
+    try:
+        chunks = itertools.chain([winner.head], winner.chunks)
+        monitor = _stall_monitor() if fallbacks else None
+        try:
+            _write_chunks(transfer, 0, chunks, abort, monitor)
+        finally:
+            nbytes = transfer.ranges[0][2]
+            transfer.stats.deliver(winner.url, nbytes, started, time.perf_counter())
+    except httpx.TransportError as e:
+        if not fallbacks or abort.is_set():
+            raise
+        _fetch_with_failover(
+            client, transfer, 0, abort, fallbacks, url=winner.url, error=e
+        )
+    finally:
+        winner.response.close()
+        transfer.save()
+    return transfer
+
+
+def _run_transfer(client, transfer, cancel=None, fallbacks=()):
+    pending = [i for i in range(len(transfer.ranges)) if not transfer.is_done(i)]
+    if show_verbose() and len(pending) > 1:
+        print(f"download {transfer.url} in {len(pending)} segments")
+
+    abort = _Abort(cancel)
+    try:
+        if len(pending) == 1:
+            _fetch_with_failover(client, transfer, pending[0], abort, fallbacks)
+            return
+        with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+            futures = [
+                executor.submit(
+                    _fetch_with_failover,
+                    client,
+                    transfer,
+                    i,
+                    abort,
+                    fallbacks,
+                    connections=len(pending),
+                )
+                for i in pending
+            ]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except BaseException:
+                # stop all other segments as early as possible
+                abort.set()
+                raise
+    finally:
+        transfer.save()
+
+
+def _probe(client, url):
+    """
+    send HEAD request to `url` and return `(size, accepts_ranges, response)`. `size`
+    is 0 if the server doesn't report a Content-Length.
+    """
+    response = client.head(url)
+    response.raise_for_status()
+    size = response.headers.get("Content-Length", None)
+    accepts_ranges = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+    return (int(size) if size else 0), accepts_ranges, response
 
-    return asyncio.run(_main())
 
+def _select_mirrors(client, transfer, mirrors):
+    """keep the mirrors that serve a file of the same size with range support"""
 
-def download(url, outpath, *, bypass_ssl=False):
+    def _agrees(url):
+        try:
+            size, accepts_ranges, _ = _probe(client, url)
+        except httpx.HTTPError as e:
+            if show_verbose():
+                print(f"skip mirror {url}: {e}")
+            return False
+        return accepts_ranges and size == transfer.size
+
+    mirrors = [url for url in mirrors if url != transfer.source]
+    if not mirrors or transfer.size is None:
+        return
+    with ThreadPoolExecutor(max_workers=len(mirrors)) as executor:
+        agreed = list(executor.map(_agrees, mirrors))
+    transfer.mirrors = [url for url, ok in zip(mirrors, agreed) if ok]
+    if transfer.mirrors:
+        hosts = ", ".join(urlparse(url).netloc for url in transfer.mirrors)
+        print(f"stripe download across {urlparse(transfer.source).netloc}, {hosts}")
+
+
+def _new_transfer(
+    client,
+    url,
+    outpath,
+    *,
+    segments,
+    resume,
+    striped=False,
+    preallocate=True,
+    **kwargs,
+):
+    transfer = _Transfer(url, outpath, resume=resume, **kwargs)
+    if segments > 1 or striped:
+        try:
+            size, accepts_ranges, response = _probe(client, url)
+            if size:
+                transfer.check_size(size, url)
+            if striped:
+                segments = -(-size // STRIPE_BLOCK_SIZE)
+            else:
+                # tiny files such as *.asc are not worth splitting
+                segments = min(segments, size // MIN_SEGMENT_SIZE)
+            if accepts_ranges and segments > 1:
+                transfer.update_validators(response)
+                transfer.split(size, segments)
+        except httpx.HTTPError as e:
+            if show_verbose():
+                print(f"failed to probe range support of {url}: {e}")
+    transfer.allocate(preallocate)
+    return transfer
+
+
+def download(
+    url,
+    outpath,
+    *,
+    bypass_ssl=False,
+    segments=1,
+    resume=False,
+    mirrors=(),
+    racers=(),
+    fallbacks=(),
+    cancel=None,
+    size=None,
+    sha256=None,
+    sinks=(),
+    preallocate=True,
+    validators=None,
+):
     """
     Download a file from `url` to `outpath` using httpx.
     Automatically follows redirects (including 301) to get the final file.
+
+    If `segments > 1` and the server supports range requests, the file is split
+    into `segments` byte ranges that are fetched concurrently. Otherwise it falls
+    back to a single stream.
+
+    If `mirrors` are provided, different byte ranges are fetched from `url` and all
+    mirrors that serve the same file at once, each with `segments` connections.
+
+    If `racers` are provided, the download starts from `url` and all racers at once,
+    and only the stream that first receives a few MB is kept.
+
+    If the transfer fails or its throughput stays below `JILL_MIN_THROUGHPUT` KB/s
+    (default 16) for `STALL_WINDOW` seconds, it continues from the current offset with
+    the next url of `fallbacks` (or of the other racers) that serves the same file.
+    A slow transfer keeps going if no fallback does.
+
+    If `resume=True`, the data is kept in `<outpath>.part` until the download
+    finishes, and an interrupted download continues from where it stopped.
+
+    `cancel` is an optional `threading.Event`; once it is set, the download stops as
+    soon as possible and raises `DownloadCancelled`.
+
+    If the expected `size` or `sha256` checksum is given, the download aborts as
+    soon as more bytes than `size` arrive, and `DownloadCorrupted` is raised before
+    the file is moved into place if the content doesn't match.
+
+    `sinks` are objects with an `update(chunk)` method that receive the file content
+    in order while it's being downloaded, e.g., `gpg_utils.GPGStreamVerifier`.
+
+    The data is written to a hidden `.part` file next to `outpath` and renamed to
+    `outpath` once it's finished and verified. If the size is known beforehand and
+    `preallocate=True`, the disk space is reserved with `fallocate` where available.
+
+    If `validators` (a dict) is given, it's filled with the url and the
+    ETag/Last-Modified of the downloaded file so that `is_modified` can check it later.
     """
+    filename = Path(outpath).name
+    striped = len(mirrors) > 0
+    client = http_client(bypass_ssl=bypass_ssl)
+    stats = _HostStats()
+    expected = dict(expected_size=size, expected_sha256=sha256, sinks=sinks)
+    expected.update(stats=stats)
+    allocate = dict(preallocate=preallocate)
 
-    verify = not bypass_ssl
-    with httpx.Client(verify=verify, follow_redirects=True) as client:
-        with client.stream("GET", url) as response:
-            response.raise_for_status()
-            filename = Path(outpath).name
-
-            with open(outpath, "wb") as f:
-                for chunk in response.iter_bytes():
-                    if chunk:
-                        f.write(chunk)
-                print(f"Downloaded {filename} successfully")
+    def _check_restart(transfer):
+        if sinks and transfer.fed > 0:
+            # sinks can't unsee the content of the previous remote file
+            raise DownloadCorrupted(f"remote {filename} changed during downloading")
+
+    def _run(transfer):
+        if striped:
+            _select_mirrors(client, transfer, mirrors)
+        if transfer.mirrors:
+            _run_striped(client, transfer, max(segments, 1), cancel)
+        else:
+            # a resumed race continues from the mirror that won it
+            others = fallbacks if fallbacks else [url] + list(racers)
+            _run_transfer(client, transfer, cancel, others)
+
+    try:
+        transfer = _Transfer.load(url, outpath, **expected) if resume else None
+        if transfer is not None:
+            print(f"resume downloading {filename} from byte {transfer.received}")
+            try:
+                _run(transfer)
+            except _RangeIgnored:
+                _check_restart(transfer)
+                print(f"remote {filename} has changed, restart downloading")
+                transfer = None
+
+        if transfer is None and racers and not striped:
+            urls = [url] + [x for x in racers if x != url]
+            transfer = _run_race(
+                client,
+                urls,
+                outpath,
+                resume=resume,
+                cancel=cancel,
+                **allocate,
+                **expected,
+            )
+        elif transfer is None:
+            transfer = _new_transfer(
+                client,
+                url,
+                outpath,
+                segments=segments,
+                resume=resume,
+                striped=striped,
+                **allocate,
+                **expected,
+            )
+            try:
+                _run(transfer)
+            except _RangeIgnored:
+                _check_restart(transfer)
+                if show_verbose():
+                    print(f"{url} ignores range requests, fallback to single stream")
+                transfer = _new_transfer(
+                    client,
+                    url,
+                    outpath,
+                    segments=1,
+                    resume=resume,
+                    **allocate,
+                    **expected,
+                )
+                _run_transfer(client, transfer, cancel, fallbacks)
+
+        if cancel is not None and cancel.is_set():
+            raise DownloadCancelled(f"downloading {filename} is cancelled")
+        transfer.verify()
+    except BaseException as e:
+        if _is_host_failure(e):
+            stats.fail(url)
+        stats.record(succeeded=False)
+        # keep resumable downloads unless they're corrupted
+        if not resume or isinstance(e, DownloadCorrupted):
+            _Transfer(url, outpath, resume=resume).discard()
+        raise
+    transfer.finish()
+    stats.record(striped=bool(transfer.mirrors))
+    if validators is not None:
+        validators.clear()
+        validators.update(
+            url=str(transfer.source),
+            etag=transfer.etag,
+            last_modified=transfer.last_modified,
+        )
+    print(f"Downloaded {filename} successfully")
@@ -5,12 +5,17 @@ if it has a specific julia download.
 
 from .defaults import default_scheme_ports
 from .defaults import SOURCE_CONFIGFILE
-from .net_utils import query_ip
-from .net_utils import port_response_time
+from .net_utils import response_times
 from .net_utils import first_response
+from .net_utils import measure_throughput
+from .net_utils import network_memo
+from .mirror_utils import mirror_cache, timeout_policy
+from .mirror_utils import refresh_mirrors as _refresh_mirrors
 from .filters import generate_info
 from .interactive_utils import color
+from .sys_utils import current_system, current_architecture
 
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
 from string import Template
 
@@ -20,6 +25,44 @@ import os
 from typing import List
 
 
+def compile_template(template: str):
+    """
+    compile the `string.Template` string `template` into a function that substitutes
+    the placeholders with values of the given mapping. Unlike `Template.substitute`,
+    the template is only parsed once.
+    """
+    parts = []  # literal strings and placeholder names (as 1-tuples)
+    last = 0
+    for m in Template.pattern.finditer(template):
+        parts.append(template[last : m.start()])
+        if m.group("escaped") is not None:
+            parts.append("$")
+        elif m.group("named") or m.group("braced"):
+            parts.append((m.group("named") or m.group("braced"),))
+        else:
+            raise ValueError(f"Invalid placeholder in template: {template}")
+        last = m.end()
+    parts.append(template[last:])
+    parts = [x for x in parts if x]
+
+    if all(isinstance(x, str) for x in parts):
+        url = "".join(parts)
+        return lambda configs: url
+
+    def generate(configs):
+        return "".join(x if isinstance(x, str) else str(configs[x[0]]) for x in parts)
+
+    return generate
+
+
+def release_info(plain_version, system, architecture, cache=dict()):
+    """`generate_info` of each release is only computed once and shared by all sources"""
+    key = (plain_version, system, architecture)
+    if key not in cache:
+        cache[key] = generate_info(plain_version, system, architecture)
+    return cache[key]
+
+
 class ReleaseSource:
     def __init__(
         self,
@@ -27,7 +70,7 @@ class ReleaseSource:
         urls: List[str],
         latest_urls: List[str],
         versions: str = None,
-        timeout=2.0,
+        timeout=None,
     ):
         # seperate stable and nightly versions because:
         #   * JuliaComputing stores them in two different s3 buckets
@@ -39,9 +82,15 @@ class ReleaseSource:
         self.url_templates = [Template(x) for x in urls]
         # TODO: make latest an optional config
         self.latest_url_templates = [Template(x) for x in latest_urls if x]
+        # the connect timeout of all hosts, it's derived from the RTT history of each
+        # host if not specified
         self.timeout = timeout
         self.versions_url = versions
         self._latencies = dict()  # type: ignore
+        self._url_generators = [compile_template(x.template) for x in self.url_templates]
+        self._latest_url_generators = [
+            compile_template(x.template) for x in self.latest_url_templates
+        ]
 
     @property
     def urls(self):
@@ -59,52 +108,118 @@ class ReleaseSource:
     def latest_hosts(self):
         return [urlparse(url).netloc for url in self.latest_urls]
 
+    @property
+    def endpoints(self):
+        """the `(hostname, port)` to connect to for each host"""
+        endpoints = dict()
+        for url in self.urls + self.latest_urls:
+            rst = urlparse(url)
+            port = rst.port if rst.port else default_scheme_ports[rst.scheme]
+            endpoints[rst.netloc] = (rst.hostname, port)
+        return endpoints
+
+    def connect_timeout(self, host):
+        return self.timeout if self.timeout else timeout_policy().connect(host)
+
+    def is_reachable(self, host):
+        return self._latencies[host] < self.connect_timeout(host)
+
     @property
     def latencies(self):
         # only check latency once and lazily
-        if not self._latencies:
-            url_list = self.urls.copy()
-            url_list.extend(self.latest_urls)
-            host_list = [urlparse(url).netloc for url in url_list]
-
-            # hosts might point to the same ip address
-            host_ip_records = {host: query_ip(host) for host in host_list}
-            ip_port_records = {
-                host_ip_records[urlparse(url).netloc]: default_scheme_ports[
-                    urlparse(url).scheme
-                ]
-                for url in url_list
-            }
-
-            latency_records = dict()
-            # TODO: use threads
-            for ip, port in ip_port_records.items():
-                latency_records[ip] = port_response_time(ip, port, self.timeout)
-            self._latencies = {
-                host: latency_records[host_ip_records[host]] for host in host_list
-            }
+        probe_latencies([self])
         return self._latencies
 
     def __repr__(self):
         return f"ReleaseSource('{self.name}')"
 
+    def candidate_urls(self, plain_version, system, architecture):
+        """
+        return all downloading urls of specific version, system and architecture
+        without checking them. Special version name such as 'latest' are treated
+        differently.
+        """
+        if plain_version == "latest":
+            generators = self._latest_url_generators
+        else:
+            generators = self._url_generators
+        configs = release_info(plain_version, system, architecture)
+        return [generate(configs) for generate in generators]
+
     def get_url(self, plain_version, system, architecture):
         """
         return one potential downloading url with minal network latency for
         specific version, system and architecture. Special version name such
         as 'latest' are treated differently.
         """
-        if plain_version == "latest":
-            template_lists = self.latest_url_templates
-        else:
-            template_lists = self.url_templates
-        configs = generate_info(plain_version, system, architecture)
-        url_list = [t.substitute(**configs) for t in template_lists]
-        url_list.sort(key=lambda url: self.latencies[urlparse(url).netloc])
+        url_list = self.candidate_urls(plain_version, system, architecture)
+        if len(url_list) > 1:
+            probe_latencies([self], [urlparse(url).netloc for url in url_list])
+            url_list.sort(key=lambda url: self._latencies[urlparse(url).netloc])
         return url_list if url_list else ""
 
 
-def read_registry():
+def probe_latencies(sources, hosts=None):
+    """
+    check the network latencies of the hosts of all `sources` at the same time. If
+    `hosts` is given, only these hosts are checked.
+
+    Each host is only checked once per run. Recently measured hosts are read from the
+    mirror cache instead. Hosts that failed repeatedly are treated as unreachable
+    until their cooldown expires, and so are hosts found unreachable in this run.
+    """
+    cache, memo = mirror_cache(), network_memo()
+    timeouts, targets = dict(), []
+    for src in sources:
+        for host, ep in src.endpoints.items():
+            if host in src._latencies or (hosts is not None and host not in hosts):
+                continue
+            if not cache.is_available(host) or memo.hosts.get(host) is False:
+                src._latencies[host] = 10 * src.connect_timeout(host)
+                continue
+            latency = cache.latency(host)
+            if latency is not None:
+                src._latencies[host] = latency
+                continue
+            timeouts[ep] = max(src.connect_timeout(host), timeouts.get(ep, 0))
+            targets.append((src, host, ep))
+    if not targets:
+        return
+    records = response_times(timeouts.keys(), timeouts)
+    latencies, failures = dict(), set()
+    for src, host, ep in targets:
+        src._latencies[host] = records[ep]
+        if records[ep] < src.connect_timeout(host):
+            latencies[host] = records[ep]
+        else:
+            failures.add(host)
+    # unreachable hosts are checked again in the next run
+    for host in failures:
+        cache.record_failure(host)
+    cache.update_latencies(latencies)
+    cache.record_rtts(latencies)
+
+
+def _config_stamp():
+    stamp = []
+    for cfg_file in SOURCE_CONFIGFILE:
+        try:
+            stamp.append((cfg_file, os.stat(cfg_file).st_mtime_ns))
+        except OSError:
+            stamp.append((cfg_file, None))
+    return tuple(stamp)
+
+
+def read_registry(cache=dict()):
+    """
+    return the process-wide registry of all release sources. The config files are only
+    read again if any of them is modified, so the parsed sources (and their latencies)
+    are shared by everyone within one run.
+    """
+    stamp = _config_stamp()
+    if cache.get("stamp", None) == stamp:
+        return cache["registry"]
+
     registry = dict()
     for cfg_file in reversed(SOURCE_CONFIGFILE):
         if not os.path.isfile(cfg_file):
@@ -113,6 +228,7 @@ def read_registry():
             upstream_records = json.load(f).get("upstream", {})
             temp_registry = {k: ReleaseSource(**v) for k, v in upstream_records.items()}
         registry.update(temp_registry)
+    cache["stamp"], cache["registry"] = stamp, registry
     return registry
 
 
@@ -128,34 +244,27 @@ def latency_string(latency):
 
 
 class SourceRegistry:
-    # share the same "full" registry across all instances
-    class __SourceRegistry:
-        def __init__(self, timeout):
-            self.timeout = timeout
-            self.registry = read_registry()
-
-    __inner_registry = None
-
-    def __init__(self, *, upstream=None, timeout=2):
+    def __init__(self, *, upstream=None, timeout=None):
         self.upstream = upstream
-        if not self.__inner_registry:
-            self.__inner_registry = self.__SourceRegistry(timeout)
+        # overrides the per-host timeouts of `timeout_policy` when probing urls
+        self.timeout = timeout
 
     @property
     def registry(self):
+        # share the same "full" registry across all instances
+        registry = read_registry()
         if self.upstream:
             # users limit themselves to only one download source
-            if self.upstream in self.__inner_registry.registry:
-                return {self.upstream: self.__inner_registry.registry[self.upstream]}
+            if self.upstream in registry:
+                return {self.upstream: registry[self.upstream]}
             else:
-                msg = "valid sources are:" + ", ".join(
-                    self.__inner_registry.registry.keys()
-                )
+                msg = "valid sources are:" + ", ".join(registry.keys())
                 raise ValueError(msg)
-        return self.__inner_registry.registry
+        return registry
 
     @property
     def latencies(self):
+        probe_latencies(self.registry.values())
         records = dict()
         for src in self.registry.values():
             records.update(src.latencies)
@@ -165,6 +274,7 @@ class SourceRegistry:
         return len(self.registry)
 
     def info(self):
+        probe_latencies(self.registry.values())
         msg = f"Found {len(self)} release sources:\n\n"
         for name, resource in self.registry.items():
             msg += f"- {color.BOLD}{name}{color.END}: {resource.name}\n"
@@ -177,6 +287,65 @@ class SourceRegistry:
                 msg += f"  * {host} ({latency} ms)\n"
         return msg
 
+    def benchmark(self, plain_version, system, architecture):
+        """
+        download the first few MB of the release from every host at the same time
+        and return `{host: record}`, where `record` is `None` if the host fails or
+        has the keys `latency`, `ttfb` (seconds) and `throughput` (bytes per second).
+        """
+        url_list = dict()
+        for src in self.registry.values():
+            for version in [plain_version, "latest"]:
+                for url in src.candidate_urls(version, system, architecture):
+                    url_list.setdefault(urlparse(url).netloc, url)
+
+        probe_latencies(self.registry.values(), url_list.keys())
+        with ThreadPoolExecutor(max_workers=max(len(url_list), 1)) as executor:
+            records = executor.map(measure_throughput, url_list.values())
+            results = dict(zip(url_list.keys(), records))
+        for host, record in results.items():
+            if record is not None:
+                record["latency"] = self._latency(host)
+        return results
+
+    def bench_info(self, plain_version, system, architecture, save=False):
+        records = self.benchmark(plain_version, system, architecture)
+        msg = f"Benchmark Julia {plain_version} for {system}-{architecture}:\n\n"
+        for host, record in records.items():
+            if record is None:
+                msg += f"  * {host} ({color.RED}failed{color.END})\n"
+                continue
+            rtt = latency_string(record["latency"])
+            ttfb = latency_string(record["ttfb"])
+            speed = record["throughput"] / 1024 / 1024
+            msg += f"  * {host} (RTT {rtt} ms, TTFB {ttfb} ms, {speed:.1f} MB/s)\n"
+            if save:
+                mirror_cache().update_throughput(host, record["throughput"])
+        return msg
+
+    def _latency(self, host):
+        return min(
+            src._latencies[host]
+            for src in self.registry.values()
+            if host in src._latencies
+        )
+
+    def _rank(self, url):
+        # prefer hosts with a higher score, i.e., measured throughput discounted by the
+        # error rate, then hosts with fewer errors and lower latency
+        cache = mirror_cache()
+        host = urlparse(url).netloc
+        latency = self._latency(host)
+        score = cache.score(host)
+        unreachable = not any(
+            src.is_reachable(host)
+            for src in self.registry.values()
+            if host in src._latencies
+        )
+        if score is None:
+            return (unreachable, 1, cache.error_rate(host), latency)
+        return (unreachable, 0, -score, latency)
+
     def _get_urls(self, plain_version, system, architecture):
         """
         return a list of potential downloading urls for specific version,
@@ -185,24 +354,73 @@ class SourceRegistry:
         """
         url_list = []
         for src in self.registry.values():
-            url_list.extend(src.get_url(plain_version, system, architecture))
+            url_list.extend(src.candidate_urls(plain_version, system, architecture))
         url_list = [url for url in url_list if url]
-        url_list.sort(key=lambda url: self.latencies[urlparse(url).netloc])
+        # skip hosts that failed repeatedly unless all of them did
+        cache = mirror_cache()
+        available = [x for x in url_list if cache.is_available(urlparse(x).netloc)]
+        url_list = available if available else url_list
+        hosts = {urlparse(url).netloc for url in url_list}
+        if len(hosts) > 1:
+            # only check the hosts that are candidates of this release, and nothing
+            # needs to be checked if there's only one choice
+            probe_latencies(self.registry.values(), hosts)
+            url_list.sort(key=self._rank)
         return url_list
 
-    def query_download_url(self, version, system, arch, *, timeout=3):
+    def query_download_url(
+        self,
+        version,
+        system,
+        arch,
+        *,
+        timeout=None,
+        min_read_timeout=0,
+        bypass_ssl=False,
+    ):
         """
         return a valid download url to nearest mirror server. If there isn't
-        such version then return None.
+        such version then return None. `timeout` defaults to the timeout of the
+        registry.
         """
         url_list = self._get_urls(version, system, arch)
-        return first_response(url_list, timeout=timeout)
-
-
-def show_upstream():
-    """print all registered upstream servers"""
+        return first_response(
+            url_list,
+            timeout=timeout if timeout is not None else self.timeout,
+            min_read_timeout=min_read_timeout,
+            bypass_ssl=bypass_ssl,
+        )
+
+    def query_mirror_urls(self, version, system, arch, *, limit=4):
+        """
+        return at most `limit` candidate urls of the same release from different
+        hosts, ordered by network latency. The urls are not checked here.
+        """
+        url_list, hosts = [], set()
+        for url in self._get_urls(version, system, arch):
+            host = urlparse(url).netloc
+            if host not in hosts:
+                hosts.add(host)
+                url_list.append(url)
+        return url_list[:limit]
+
+
+def show_upstream(refresh_mirrors=False, bench=False, save=False):
+    """
+    print all registered upstream servers. If `bench=True`, also download the first
+    few MB of the latest stable release from every host to measure their throughput,
+    and with `save=True` the results are used to order mirrors in later downloads.
+    """
+    if refresh_mirrors:
+        _refresh_mirrors()
     registry = SourceRegistry()
     print(registry.info())
+    if bench:
+        from .version_utils import latest_version
+
+        system, arch = current_system(), current_architecture()
+        version = latest_version("", system, arch)
+        print(registry.bench_info(version, system, arch, save=save))
 
 
 def verify_upstream(registry_name):
@@ -3,12 +3,19 @@ from .filters import canonicalize_arch, canonicalize_sys
 from .defaults import load_versions_schema
 from .defaults import DEFAULT_VERSIONS_URL, VERSIONS_SCHEMA_URL
 from .net_utils import first_response
+from .net_utils import http_client
+from .catalog_utils import versions_cache
+from .catalog_utils import content_hash, validate_catalog
+from .catalog_utils import catalog_files
+from .catalog_utils import CatalogUnavailable
 from .source_utils import read_registry
 from .interactive_utils import color
 import semantic_version
 
 import httpx
-import jsonschema
+import os
+import sys
+from urllib.parse import urlparse
 
 from jsonschema.exceptions import ValidationError
 from typing import Tuple, List
@@ -24,6 +31,14 @@ def is_full_version(version: str):
     return True
 
 
+def _prerelease_key(prerelease):
+    # a release has higher precedence than its pre-releases, numeric identifiers have
+    # lower precedence than alphanumeric ones
+    if not prerelease:
+        return ((2,),)
+    return tuple((0, int(x), "") if x.isdigit() else (1, 0, x) for x in prerelease)
+
+
 class Version(semantic_version.Version):
     """
     a thin wrapper on semantic_version.Version that
@@ -44,6 +59,13 @@ class Version(semantic_version.Version):
             self.minor_version = f_minor_version(version_string)
             self.patch_version = f_patch_version(version_string)
         super(Version, self).__init__(version_string)
+        # versions can be ordered by comparing these tuples
+        self.sort_key = (
+            self.major,
+            self.minor,
+            self.patch,
+            _prerelease_key(self.prerelease),
+        )
 
     # TODO: we can actually wrap latest_version here
     @staticmethod
@@ -64,58 +86,235 @@ class Version(semantic_version.Version):
         return ".".join([major, minor, patch])
 
 
-def read_remote_versions(upstream, cache=dict()):
+def _fetch_remote_versions(upstream, catalog):
     """
-    If not cached, download and read json content from remote URL `url`.
+    download versions.json into `catalog` unless the cached copy is still up to date
     """
-    if not cache:
-        registry = read_registry()
-        if upstream in registry and registry[upstream].versions_url is not None:
-            # For backward-compatibility, `versions` item is optional (issue #64)
-            versions_url = registry[upstream].versions_url
-        else:
-            # If not specified, use the first response as the result
-            # TODO: we can share the first_response result here so that later
-            #       downloading (e.g., `query_download_url`) does not need to check
-            #       it again.
-            versions_url_list = [x.versions_url for x in registry.values()]
-            versions_url = first_response(versions_url_list, timeout=0.5)
-            versions_url = versions_url if versions_url else DEFAULT_VERSIONS_URL
+    registry = read_registry()
+    if upstream in registry and registry[upstream].versions_url is not None:
+        # For backward-compatibility, `versions` item is optional (issue #64)
+        versions_url = registry[upstream].versions_url
+    else:
+        # If not specified, use the first response as the result. The probe
+        # outcomes are kept in `network_memo` so that later queries (e.g.,
+        # `query_download_url`) don't check these hosts again.
+        versions_url_list = [x.versions_url for x in registry.values()]
+        versions_url = first_response(versions_url_list)
+        versions_url = versions_url if versions_url else DEFAULT_VERSIONS_URL
+    print(f"{color.GREEN}querying release information from {versions_url}{color.END}")
+
+    try:
+        response = http_client().get(
+            versions_url, headers=catalog.validators(versions_url)
+        )
+        if response.status_code == 304:
+            catalog.touch()
+            return
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        if not catalog.has_versions():
+            raise
         print(
-            f"{color.GREEN}querying release information from {versions_url}{color.END}"
+            f"{color.YELLOW}failed to query release information ({e}), use the cached copy instead{color.END}"
         )
+        return
+    content, headers = response.content, response.headers
+    version_list = response.json()
+    if content_hash(content) == catalog.validated:
+        # the same content is validated before, e.g., the server doesn't support
+        # conditional requests
+        catalog.update(versions_url, content, version_list, headers)
+        return
+    # only releases that are added or changed since the validated copy are checked
+    validated = catalog.versions
 
-        with httpx.Client(follow_redirects=True) as client:
-            response = client.get(versions_url)
-            response.raise_for_status()
-            version_list = response.json()
-
-        # Validate the downloaded content with `versions_schema.json`.
-        # This file is unlikely to be outdated so we keep a copy
-        # inside `jill`. If it gets outdated, then print a warning message and
-        # download the lastest schema file.
-        # When there're new arch/sys that makes this our copy outdated, it's very
-        # likely that `jill` doesn't support it.
-        schema = load_versions_schema()
-        try:
-            jsonschema.validate(version_list, schema)
-            is_valid = True
-        except ValidationError:
-            is_valid = False
-            print(
-                f"{color.YELLOW} failed to validate versions file, retry with latest schema..."
+    # Validate the downloaded content with `versions_schema.json`.
+    # This file is unlikely to be outdated so we keep a copy
+    # inside `jill`. If it gets outdated, then print a warning message and
+    # download the lastest schema file.
+    # When there're new arch/sys that makes this our copy outdated, it's very
+    # likely that `jill` doesn't support it.
+    schema = load_versions_schema()
+    try:
+        validate_catalog(version_list, schema, validated)
+        is_valid = True
+    except ValidationError:
+        is_valid = False
+        print(
+            f"{color.YELLOW} failed to validate versions file, retry with latest schema..."
+        )
+        response = http_client().get(VERSIONS_SCHEMA_URL)
+        response.raise_for_status()
+        schema = response.json()
+    if not is_valid:
+        validate_catalog(version_list, schema, validated)
+
+    catalog.update(versions_url, content, version_list, headers)
+
+
+def parse_version(version_string: str, cache=dict()) -> Version:
+    """
+    return `Version(version_string)`. Each version string is only parsed once and the
+    same object is returned for it, so it must not be modified.
+    """
+    v = cache.get(version_string, None)
+    if v is None:
+        v = cache.setdefault(sys.intern(version_string), Version(version_string))
+    return v
+
+
+def update_catalog(upstream=None, cache=dict()):
+    """
+    return the cached release catalog. It's checked, and downloaded again if it's
+    modified on the server, at most once per process.
+    """
+    if not cache:
+        catalog = versions_cache()
+        if catalog.offline:
+            if not catalog.has_versions():
+                raise CatalogUnavailable(
+                    "no cached release information, please run jill without `--offline` first"
+                )
+        elif not catalog.is_fresh():
+            _fetch_remote_versions(upstream, catalog)
+        cache["catalog"] = catalog
+    return cache["catalog"]
+
+
+def read_remote_versions(upstream, cache=dict()):
+    """
+    If not cached, read the release catalog `versions.json`. The downloaded catalog is
+    kept on disk, and it's only downloaded again if it's modified on the server.
+    """
+    if not cache:
+        catalog = update_catalog(upstream)
+        if catalog.versions is None and not catalog.offline:
+            # the cached copy is broken
+            _fetch_remote_versions(upstream, catalog)
+        if catalog.versions is None and catalog.offline:
+            raise CatalogUnavailable(
+                "the cached release information is broken, please run jill without `--offline`"
             )
-            with httpx.Client(follow_redirects=True) as client:
-                response = client.get(VERSIONS_SCHEMA_URL)
-                response.raise_for_status()
-                schema = response.json()
-        if not is_valid:
-            jsonschema.validate(version_list, schema)
-
-        cache.update(version_list)
+        if catalog.versions is None:
+            raise ValueError("failed to read the cached release information")
+        cache.update(catalog.versions)
     return cache
 
 
+class _ReleaseView:
+    """
+    releases of the catalog indexed for lookups, see `ReleaseCatalog`
+    """
+
+    def __init__(self, releases):
+        # `(Version, (ver, os, arch))` in catalog order
+        self.releases = [(v.sort_key, item) for v, item in releases]
+        self.index = {item for _, item in releases}
+
+        platforms = dict()
+        for v, (ver, os, arch) in releases:
+            platforms.setdefault((os, arch), dict())[ver] = v
+        # ascending `([sort_key], [ver])` of each `(os, arch)`, and of each minor line
+        self.versions = dict()
+        self.minors = dict()
+        for platform, records in platforms.items():
+            records = sorted(records.items(), key=lambda x: x[1].sort_key)
+            self.versions[platform] = (
+                [v.sort_key for _, v in records],
+                [x for x, _ in records],
+            )
+            buckets = dict()
+            for ver, v in records:
+                keys, names = buckets.setdefault(v.minor_version, ([], []))
+                keys.append(v.sort_key)
+                names.append(ver)
+            self.minors[platform] = buckets
+
+
+class ReleaseCatalog:
+    """
+    an index of the release catalog `versions.json`. Stable releases and all releases
+    are indexed separately so that queries don't need to filter the catalog again.
+    """
+
+    def __init__(self, files):
+        # `files` are the `CatalogFile`s of the catalog, e.g., a `CatalogSnapshot`
+        self._files = dict()
+        releases, stable_releases = [], []
+        for file in files:
+            ver = sys.intern(file.version)
+            self._files.setdefault(ver, []).append(file)
+            try:
+                v = parse_version(ver)
+            except ValueError:
+                continue
+            os = file.os
+            libc = file.triplet.split("-")[2]
+            if libc == "musl":
+                # currently Julia tags musl as a system, e.g.,
+                # https://julialang-s3.julialang.org/bin/musl/x64/1.5/julia-1.5.1-musl-x86_64.tar.gz
+                os = "musl"
+            releases.append((v, (ver, sys.intern(os), sys.intern(file.arch))))
+            if file.stable:
+                stable_releases.append(releases[-1])
+        self._views = {False: _ReleaseView(releases), True: _ReleaseView(stable_releases)}
+
+    def release_file(self, version, filename):
+        """the record of release file `filename` of `version`, or `None`"""
+        for file in self._files.get(version, []):
+            if os.path.basename(urlparse(file.url).path) == filename:
+                return file._asdict()
+        return None
+
+    def releases(self, minimal_version="0.6.0", stable_only=False):
+        """all `(ver, os, arch)` releases that are not older than `minimal_version`"""
+        minimal_key = parse_version(minimal_version).sort_key
+        view = self._views[stable_only]
+        return [item for key, item in view.releases if key >= minimal_key]
+
+    def is_released(
+        self, version, system, arch, minimal_version="0.6.0", stable_only=False
+    ):
+        if (version, system, arch) not in self._views[stable_only].index:
+            return False
+        try:
+            return parse_version(version) >= parse_version(minimal_version)
+        except ValueError:
+            return False
+
+    def latest(
+        self, system, arch, minor_version=None, minimal_version="0.6.0", stable_only=False
+    ):
+        """
+        return the latest release for `system` and `arch`, or `None` if there's no such
+        release. If `minor_version` (e.g., "1.6") is given, only releases of this
+        minor line are considered.
+        """
+        view = self._views[stable_only]
+        if minor_version is None:
+            keys, names = view.versions.get((system, arch), ([], []))
+        else:
+            keys, names = view.minors.get((system, arch), {}).get(minor_version, ([], []))
+        if not keys or keys[-1] < parse_version(minimal_version).sort_key:
+            return None
+        return names[-1]
+
+
+def release_catalog(upstream=None, cache=dict()) -> ReleaseCatalog:
+    """
+    return the index of the release catalog. It's built from the snapshot of the
+    cached catalog so that the catalog itself doesn't need to be parsed.
+    """
+    if not cache:
+        catalog = update_catalog(upstream)
+        files = catalog.snapshot()
+        if files is None:
+            files = catalog_files(read_remote_versions(upstream))
+            catalog.write_snapshot()
+        cache["catalog"] = ReleaseCatalog(files)
+    return cache["catalog"]
+
+
 def read_releases(
     minimal_version="0.6.0", stable_only=False, upstream=None
 ) -> List[Tuple[str, str, str]]:
@@ -123,34 +322,24 @@ def read_releases(
     read release info from versions.json.
     The content will be cached so will only download the data once.
     """
-    # Here we only cache the raw content so that post processing like `stable_only` filter
-    # works as expected.
-    v = read_remote_versions(upstream=upstream)
-    releases = []
-    for item in v.items():
-        ver = item[0]
-        is_stable = item[1]["stable"]
-        if not stable_only or is_stable:
-            # minimal_version works only when is_stable=True
-            try:
-                if Version(ver) < Version(minimal_version):
-                    continue
-            except:
-                continue
+    catalog = release_catalog(upstream=upstream)
+    return catalog.releases(minimal_version=minimal_version, stable_only=stable_only)
+
 
-            files = item[1]["files"]
-            for file in files:
-                os = file["os"]
-                libc = file["triplet"].split("-")[2]
-                if libc == "musl":
-                    # currently Julia tags musl as a system, e.g.,
-                    # https://julialang-s3.julialang.org/bin/musl/x64/1.5/julia-1.5.1-musl-x86_64.tar.gz
-                    os = "musl"
-                releases.append((ver, os, file["arch"]))
-    return releases
+def query_release_file(version, filename, upstream=None):
+    """
+    return the versions.json record of release file `filename`, e.g.,
+    `julia-1.6.0-linux-x86_64.tar.gz`. It has `size` and `sha256` of the file.
+    Return None if it's not recorded, e.g., nightly builds.
+    """
+    if version == "latest":
+        return None
+    return release_catalog(upstream=upstream).release_file(str(version), filename)
 
 
-def is_version_released(version, system, arch, **kwargs):
+def is_version_released(
+    version, system, arch, minimal_version="0.6.0", stable_only=False, upstream=None
+):
     """
     Checks if the given version number is released for the given system and architecture.
     Note: returns True for version="latest" if system and architecture are valid.
@@ -161,9 +350,15 @@ def is_version_released(version, system, arch, **kwargs):
         # return True here without any extra checks.
         return True
 
-    version_list = read_releases(**kwargs)
-    item = str(version), canonicalize_sys(system), canonicalize_arch(arch)
-    return item in version_list
+    catalog = release_catalog(upstream=upstream)
+    system, arch = canonicalize_sys(system), canonicalize_arch(arch)
+    return catalog.is_released(
+        str(version),
+        system,
+        arch,
+        minimal_version=minimal_version,
+        stable_only=stable_only,
+    )
 
 
 def canonicalize_version(version: str) -> str:
@@ -176,7 +371,14 @@ def canonicalize_version(version: str) -> str:
     return version
 
 
-def latest_version(version: str, system, arch, **kwargs) -> str:
+def latest_version(
+    version: str,
+    system,
+    arch,
+    minimal_version="0.6.0",
+    stable_only=False,
+    upstream=None,
+) -> str:
     """
     Autocompletes a partial semantic version string to the latest compatible full version string.
     Directly returns `version` if it's already a complete version string (without checking that it's
@@ -188,7 +390,7 @@ def latest_version(version: str, system, arch, **kwargs) -> str:
 
     system, arch = canonicalize_sys(system), canonicalize_arch(arch)
     # supporting legacy versions is really of low priority
-    if version and Version(version) < Version("0.6.0"):
+    if version and parse_version(version) < parse_version("0.6.0"):
         raise (ValueError('Julia < v"0.6.0" is not supported.'))
 
     # Download whatever the user requests; ignores `stable_only`.
@@ -196,9 +398,10 @@ def latest_version(version: str, system, arch, **kwargs) -> str:
         return version
 
     # query system/architecture-compatible releases
-    releases = read_releases(**kwargs)
-    compat_releases = [x for x in releases if x[1] == system and x[2] == arch]
-    if len(compat_releases) == 0:
+    catalog = release_catalog(upstream=upstream)
+    query = dict(minimal_version=minimal_version, stable_only=stable_only)
+    latest_ver = catalog.latest(system, arch, **query)
+    if latest_ver is None:
         raise (
             ValueError(
                 f"Julia release for system {system} and architecture {arch} is not available."
@@ -207,15 +410,11 @@ def latest_version(version: str, system, arch, **kwargs) -> str:
 
     if len(version.strip()) == 0:
         # version is an empty string => try to find latest compatible release
-        return max(compat_releases, key=lambda x: Version(x[0]))[0]
+        return latest_ver
     else:
-        filtered_compat = [
-            x
-            for x in compat_releases
-            if Version(x[0]).minor_version == Version(version).minor_version
-        ]
-        if len(filtered_compat) == 0:
-            latest_ver = max(compat_releases, key=lambda x: Version(x[0]))[0]
+        minor_version = parse_version(version).minor_version
+        latest_compat = catalog.latest(system, arch, minor_version, **query)
+        if latest_compat is None:
             print(
                 f'{color.RED}failed to find latest Julia version for "{version}", "{system}" and "{arch}". Trying latest compatible version "{latest_ver}" instead.{color.END}'
             )
@@ -226,5 +425,4 @@ def latest_version(version: str, system, arch, **kwargs) -> str:
             # latest_version('', system, arch, stable_only=stable_only)
             return latest_ver
         else:
-            latest_compat = max(filtered_compat, key=lambda x: Version(x[0]))
-            return latest_compat[0]
+            return latest_compat